@@ -25,7 +25,7 @@ from services.image_generator import ImageGenerator
 from services.video_composer import VideoComposer
 from services.file_manager import FileManager
 from services.database import DatabaseService, init_database_service, close_database_service, get_database_service
-from utils.config import Config
+from utils.config import get_config as load_config
 from utils.logger import setup_logger
 
 # 初始化应用
@@ -134,7 +134,7 @@ class GalleryComposeVideoRequest(BaseModel):
     include_original: bool = False
 
 # 初始化服务
-config = Config()
+config = load_config()
 logger = setup_logger()
 file_manager = FileManager(config.STORAGE_PATH)
 image_generator = ImageGenerator(config)
@@ -144,9 +144,17 @@ video_composer = VideoComposer(config)
 active_tasks = {}
 # history_tasks 现在存储在 MongoDB 中，不再使用内存变量
 
+# 进度更新合并：task_id -> [上次写入的进度（0.01%为单位）, 写入时间, 等待补写的进度或None]
+_progress_last: Dict[str, list] = {}
+_PROGRESS_MIN_INTERVAL = 0.05  # 秒
+# 主事件循环，供线程池中的进度回调安排补写
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+
 @app.on_event("startup")
 async def startup_event():
     """应用启动事件"""
+    global _event_loop
+    _event_loop = asyncio.get_running_loop()
     logger.info("🚀 正在启动 Stylize Video Backend...")
     
     # 初始化MongoDB数据库连接
@@ -213,7 +221,7 @@ async def get_history_tasks(limit: int = 50, skip: int = 0):
     """获取历史任务列表"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 获取历史任务列表
@@ -247,7 +255,7 @@ async def delete_history_task(task_id: str):
     """删除历史任务及其相关文件"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 获取要删除的任务详情
@@ -255,19 +263,22 @@ async def delete_history_task(task_id: str):
         if not task:
             raise HTTPException(status_code=404, detail="历史任务不存在")
         
-        # 删除任务相关的文件
+        # 删除任务相关的文件（生成图片和视频），仍被其他历史任务引用的文件保留
+        candidate_ids = [image['file_id'] for image in task.get('images') or [] if image and image.get('file_id')]
+        if task.get('video_id'):
+            candidate_ids.append(task['video_id'])
+        
+        protected_files = await db_service.get_files_referenced_by_other_tasks(task_id, candidate_ids)
+        
         deleted_files = []
-        if 'images' in task:
-            for image in task['images']:
-                if 'file_id' in image:
-                    file_id = image['file_id']
-                    if file_manager.delete_file(file_id):
-                        deleted_files.append(file_id)
-        
-        if 'video_id' in task:
-            video_id = task['video_id']
-            if file_manager.delete_file(video_id):
-                deleted_files.append(video_id)
+        for file_id in candidate_ids:
+            if file_id in protected_files:
+                continue
+            if file_manager.delete_file(file_id):
+                deleted_files.append(file_id)
+        
+        if protected_files:
+            logger.info(f"保留被其他历史任务引用的文件: {sorted(protected_files)}")
         
         # 从数据库中删除任务记录
         success = await db_service.delete_history_task(task_id)
@@ -277,7 +288,8 @@ async def delete_history_task(task_id: str):
                 "success": True,
                 "message": f"历史任务 {task_id} 删除成功",
                 "deleted_files": deleted_files,
-                "deleted_count": len(deleted_files)
+                "deleted_count": len(deleted_files),
+                "protected_files": sorted(protected_files)
             }
         else:
             raise HTTPException(status_code=500, detail="删除历史任务失败")
@@ -343,7 +355,7 @@ async def delete_image(image_id: str):
     """删除图片文件"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 从所有历史任务中移除对该图片的引用
@@ -369,7 +381,7 @@ async def create_gallery_group(request: GalleryGroupCreateRequest):
     """创建图库分组"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 生成分组ID
@@ -398,7 +410,7 @@ async def get_gallery_groups():
     """获取所有图库分组"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 获取分组列表
@@ -420,7 +432,7 @@ async def get_gallery_group(group_id: str):
     """获取图库分组详情"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 获取分组信息
@@ -444,7 +456,7 @@ async def update_gallery_group(group_id: str, request: GalleryGroupUpdateRequest
     """更新图库分组"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 检查分组是否存在
@@ -474,7 +486,7 @@ async def delete_gallery_group(group_id: str):
     """删除图库分组"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 检查分组是否存在
@@ -504,7 +516,7 @@ async def upload_gallery_image(file: UploadFile = File(...), group_id: str = For
     """上传图片到图库分组"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 验证文件类型
@@ -559,7 +571,7 @@ async def get_gallery_images(group_id: str):
     """获取图库分组中的所有图片"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 检查分组是否存在
@@ -586,7 +598,7 @@ async def delete_gallery_image(image_id: str):
     """删除图库图片"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 删除数据库记录
@@ -614,7 +626,7 @@ async def batch_delete_gallery_images(request: GalleryImageBatchDeleteRequest):
     """批量删除图库图片"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 删除数据库记录
@@ -744,6 +756,7 @@ async def compose_gallery_video_async(task_id: str, selected_image_ids: List[str
         }
         
         active_tasks[task_id].update(completed_task)
+        _progress_last.pop(task_id, None)
         
         # 保存到MongoDB历史任务
         await save_task_to_history(task_id)
@@ -755,6 +768,7 @@ async def compose_gallery_video_async(task_id: str, selected_image_ids: List[str
             'message': f'合成失败: {str(e)}',
             'error': str(e)
         })
+        _progress_last.pop(task_id, None)
 
 @app.get('/api/tasks/{task_id}')
 async def get_task_status(task_id: str):
@@ -764,7 +778,7 @@ async def get_task_status(task_id: str):
     else:
         # 检查是否是历史任务
         db_service = await get_database_service()
-        if db_service and db_service.is_connected():
+        if db_service and db_service.is_connected:
             task = await db_service.get_history_task_by_id(task_id)
             if task:
                 return task
@@ -815,7 +829,7 @@ async def regenerate_video(request: RegenerateVideoRequest, background_tasks: Ba
     """从历史任务重新生成视频"""
     try:
         db_service = await get_database_service()
-        if not db_service or not db_service.is_connected():
+        if not db_service or not db_service.is_connected:
             raise HTTPException(status_code=503, detail="数据库不可用")
         
         # 获取历史任务
@@ -926,7 +940,7 @@ async def compose_video(request: ComposeVideoRequest, background_tasks: Backgrou
         if not original_task:
             # 检查历史任务
             db_service = await get_database_service()
-            if db_service and db_service.is_connected():
+            if db_service and db_service.is_connected:
                 history_task = await db_service.get_history_task_by_id(request.task_id)
                 if history_task:
                     original_task = history_task
@@ -1067,6 +1081,7 @@ async def generate_video_async(task_id: str, image_id: str, api_key: str,
         }
         
         active_tasks[task_id].update(completed_task)
+        _progress_last.pop(task_id, None)
         
         # 保存到MongoDB历史任务
         await save_task_to_history(task_id)
@@ -1078,6 +1093,7 @@ async def generate_video_async(task_id: str, image_id: str, api_key: str,
             'message': f'生成失败: {str(e)}',
             'error': str(e)
         })
+        _progress_last.pop(task_id, None)
 
 async def regenerate_video_async(task_id: str, original_image_id: str, 
                                  audio_id: Optional[str], config: Dict, 
@@ -1147,6 +1163,7 @@ async def regenerate_video_async(task_id: str, original_image_id: str,
         }
         
         active_tasks[task_id].update(completed_task)
+        _progress_last.pop(task_id, None)
         
         # 保存到MongoDB历史任务
         await save_task_to_history(task_id)
@@ -1158,6 +1175,7 @@ async def regenerate_video_async(task_id: str, original_image_id: str,
             'message': f'重新生成失败: {str(e)}',
             'error': str(e)
         })
+        _progress_last.pop(task_id, None)
 
 async def generate_images_async(task_id: str, image_id: str, api_key: str, config: Dict):
     """只生成图片，不进行视频合成"""
@@ -1219,6 +1237,7 @@ async def generate_images_async(task_id: str, image_id: str, api_key: str, confi
         }
         
         active_tasks[task_id].update(completed_task)
+        _progress_last.pop(task_id, None)
         
         # 保存到MongoDB历史任务（用于历史功能）
         await save_task_to_history(task_id)
@@ -1230,6 +1249,7 @@ async def generate_images_async(task_id: str, image_id: str, api_key: str, confi
             'message': f'生成失败: {str(e)}',
             'error': str(e)
         })
+        _progress_last.pop(task_id, None)
 
 async def compose_video_async(task_id: str, original_image_id: str, audio_id: Optional[str], 
                               config: Dict, selected_image_ids: List[str], include_original: bool):
@@ -1285,6 +1305,7 @@ async def compose_video_async(task_id: str, original_image_id: str, audio_id: Op
         }
         
         active_tasks[task_id].update(completed_task)
+        _progress_last.pop(task_id, None)
         
         # 保存到MongoDB历史任务
         await save_task_to_history(task_id)
@@ -1296,12 +1317,70 @@ async def compose_video_async(task_id: str, original_image_id: str, audio_id: Op
             'message': f'合成失败: {str(e)}',
             'error': str(e)
         })
+        _progress_last.pop(task_id, None)
 
 def update_progress(task_id: str, progress: float, message: str):
-    """更新任务进度"""
-    if task_id in active_tasks:
-        active_tasks[task_id]['progress'] = min(100, max(0, progress))
-        active_tasks[task_id]['message'] = message
+    """
+    更新任务进度
+    
+    进度按0.01%取整，数值和消息都没变化时直接跳过；消息不变时50毫秒内的连续更新合并，
+    窗口结束时补写最新值，不会丢失最后一次更新（到达100%的更新总是立即写入）。
+    可以在事件循环线程或线程池中调用。
+    """
+    task = active_tasks.get(task_id)
+    if task is None:
+        _progress_last.pop(task_id, None)
+        return
+    
+    centi = int(min(100.0, max(0.0, progress)) * 100)
+    now = time.monotonic()
+    state = _progress_last.get(task_id)
+    if state is not None and message == task.get('message'):
+        last_centi, last_time, pending = state
+        if centi == last_centi:
+            state[2] = None
+            return
+        if centi < 10000 and now - last_time < _PROGRESS_MIN_INTERVAL:
+            if pending is None:
+                _schedule_progress_flush(task_id, _PROGRESS_MIN_INTERVAL - (now - last_time))
+            state[2] = centi
+            return
+    
+    _progress_last[task_id] = [centi, now, None]
+    task['progress'] = centi / 100
+    task['message'] = message
+
+def _schedule_progress_flush(task_id: str, delay: float):
+    """
+    在应用主事件循环中安排一次进度补写
+    
+    图片生成的进度回调运行在线程池中各自的 asyncio.run 临时事件循环里，
+    补写不能安排在这种循环上，否则循环关闭后补写会丢失。
+    """
+    loop = _event_loop
+    if loop is None or loop.is_closed():
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        loop.call_later(delay, _flush_progress, task_id)
+    else:
+        loop.call_soon_threadsafe(loop.call_later, delay, _flush_progress, task_id)
+
+def _flush_progress(task_id: str):
+    """写入合并窗口内被推迟的最新进度"""
+    state = _progress_last.get(task_id)
+    if state is None or state[2] is None:
+        return
+    task = active_tasks.get(task_id)
+    if task is None:
+        _progress_last.pop(task_id, None)
+        return
+    
+    state[0], state[1], state[2] = state[2], time.monotonic(), None
+    task['progress'] = state[0] / 100
 
 async def save_task_to_history(task_id: str):
     """保存任务到MongoDB历史记录"""
@@ -1309,7 +1388,7 @@ async def save_task_to_history(task_id: str):
         return False
     
     db_service = await get_database_service()
-    if db_service and db_service.is_connected():
+    if db_service and db_service.is_connected:
         try:
             task_data = active_tasks[task_id].copy()
             success = await db_service.save_history_task(task_id, task_data)
@@ -5,17 +5,49 @@ MongoDB数据库服务
 用于持久化存储历史任务和文件元数据
 """
 import asyncio
-from datetime import datetime
-from typing import Dict, List, Optional, Any
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Any, Iterable, Set
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
+from pymongo.errors import DuplicateKeyError
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 按唯一键查询时显式指定的索引，跳过查询计划器的多计划评估
+_ID_INDEX = [("id", 1)]
+_STATUS_CREATED_AT_INDEX = [("status", 1), ("created_at", -1)]
+
+# 检查文件引用时只读取引用文件的字段
+_TASK_FILE_FIELDS = {"_id": 0, "images.file_id": 1, "original_image_id": 1, "video_id": 1}
+
+# 旧任务清理：最小间隔与每批删除的文档数
+_CLEANUP_INTERVAL = timedelta(hours=1)
+_CLEANUP_BATCH_SIZE = 1000
+
+
+def get_task_file_ids(task: Dict[str, Any]) -> Set[str]:
+    """获取历史任务引用的所有文件ID（生成图片、原始图片、视频）"""
+    file_ids = set()
+    for image in task.get('images') or []:
+        if image and image.get('file_id'):
+            file_ids.add(image['file_id'])
+    if task.get('original_image_id'):
+        file_ids.add(task['original_image_id'])
+    if task.get('video_id'):
+        file_ids.add(task['video_id'])
+    return file_ids
+
 
 class DatabaseService:
     """MongoDB数据库服务类"""
     
+    __slots__ = (
+        'mongodb_url', 'database_name', 'client', 'database',
+        'history_collection', 'files_collection',
+        'gallery_groups_collection', 'gallery_images_collection',
+        '_is_connected', '_last_cleanup_at', '_history_list_hint'
+    )
+    
     def __init__(self, mongodb_url: str, database_name: str):
         self.mongodb_url = mongodb_url
         self.database_name = database_name
@@ -26,6 +58,8 @@ class DatabaseService:
         self.gallery_groups_collection: Optional[AsyncIOMotorCollection] = None  # 图库分组集合
         self.gallery_images_collection: Optional[AsyncIOMotorCollection] = None  # 图库图片集合
         self._is_connected = False
+        self._last_cleanup_at: Dict[int, datetime] = {}  # 保留天数 -> 上次清理时间
+        self._history_list_hint: Optional[List] = None  # 历史列表查询使用的索引（仅在索引创建成功后设置）
     
     async def connect(self):
         """连接到MongoDB"""
@@ -43,11 +77,11 @@ class DatabaseService:
             await self._create_indexes()
             
             self._is_connected = True
-            logger.info(f"MongoDB连接成功: {self.mongodb_url}")
+            logger.info("MongoDB连接成功: %s", self.mongodb_url)
             return True
             
         except Exception as e:
-            logger.error(f"MongoDB连接失败: {str(e)}")
+            logger.error("MongoDB连接失败: %s", e)
             self._is_connected = False
             return False
     
@@ -59,39 +93,57 @@ class DatabaseService:
             logger.info("MongoDB连接已关闭")
     
     async def _create_indexes(self):
-        """创建数据库索引"""
-        try:
-            # 为历史任务集合创建索引
-            await self.history_collection.create_index("task_id", unique=True)
-            await self.history_collection.create_index("created_at")
-            await self.history_collection.create_index("status")
-            
-            # 为文件元数据集合创建索引
-            await self.files_collection.create_index("file_id", unique=True)
-            await self.files_collection.create_index("created_at")
-            
-            # 为图库分组集合创建索引
-            await self.gallery_groups_collection.create_index("id", unique=True)
-            await self.gallery_groups_collection.create_index("name")
-            await self.gallery_groups_collection.create_index("created_at")
-            
-            # 为图库图片集合创建索引
-            await self.gallery_images_collection.create_index("id", unique=True)
-            await self.gallery_images_collection.create_index("group_id")
-            await self.gallery_images_collection.create_index("created_at")
-            await self.gallery_images_collection.create_index([("group_id", 1), ("created_at", -1)])
-            
+        """创建数据库索引（并发创建，单个索引失败不影响其余索引）"""
+        specs = [
+            # 历史任务集合
+            (self.history_collection, "task_id", {"unique": True}),
+            (self.history_collection, "created_at", {}),
+            (self.history_collection, "status", {}),
+            (self.history_collection, _STATUS_CREATED_AT_INDEX, {}),
+            (self.history_collection, "images.file_id", {}),
+            (self.history_collection, "original_image_id", {}),
+            (self.history_collection, "video_id", {}),
+            # 文件元数据集合
+            (self.files_collection, "file_id", {"unique": True}),
+            (self.files_collection, "created_at", {}),
+            # 图库分组集合
+            (self.gallery_groups_collection, _ID_INDEX, {"unique": True}),
+            (self.gallery_groups_collection, "name", {}),
+            (self.gallery_groups_collection, "created_at", {}),
+            # 图库图片集合
+            (self.gallery_images_collection, _ID_INDEX, {"unique": True}),
+            (self.gallery_images_collection, "group_id", {}),
+            (self.gallery_images_collection, "created_at", {}),
+            (self.gallery_images_collection, [("group_id", 1), ("created_at", -1)], {}),
+        ]
+        
+        results = await asyncio.gather(
+            *(coll.create_index(keys, **kwargs) for coll, keys, kwargs in specs),
+            return_exceptions=True
+        )
+        
+        failed = 0
+        for (coll, keys, _), result in zip(specs, results):
+            if isinstance(result, Exception):
+                failed += 1
+                logger.warning("创建索引失败: %s %s - %s", coll.name, keys, result)
+            elif coll is self.history_collection and keys is _STATUS_CREATED_AT_INDEX:
+                # hint指定的索引不存在时查询会直接报错，只有索引确实存在才使用hint
+                self._history_list_hint = _STATUS_CREATED_AT_INDEX
+        
+        if failed:
+            logger.error("数据库索引创建部分失败: %d/%d", failed, len(specs))
+        else:
             logger.info("数据库索引创建完成")
-        except Exception as e:
-            logger.error(f"创建数据库索引失败: {str(e)}")
     
+    @property
     def is_connected(self) -> bool:
         """检查是否已连接"""
         return self._is_connected
     
     async def save_history_task(self, task_id: str, task_data: Dict[str, Any]) -> bool:
         """保存历史任务"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法保存历史任务")
             return False
         
@@ -99,7 +151,7 @@ class DatabaseService:
             # 添加保存时间戳
             task_data_copy = task_data.copy()
             task_data_copy['task_id'] = task_id
-            task_data_copy['saved_at'] = datetime.utcnow()
+            task_data_copy['saved_at'] = datetime.now(timezone.utc)
             
             # 使用upsert操作，如果任务已存在则更新
             result = await self.history_collection.replace_one(
@@ -108,16 +160,16 @@ class DatabaseService:
                 upsert=True
             )
             
-            logger.info(f"历史任务已保存: task_id={task_id}")
+            logger.info("历史任务已保存: task_id=%s", task_id)
             return True
             
         except Exception as e:
-            logger.error(f"保存历史任务失败 (task_id: {task_id}): {str(e)}")
+            logger.error("保存历史任务失败 (task_id: %s): %s", task_id, e)
             return False
     
     async def get_history_tasks(self, limit: int = 50, skip: int = 0) -> List[Dict[str, Any]]:
         """获取历史任务列表"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，返回空历史任务列表")
             return []
         
@@ -126,18 +178,20 @@ class DatabaseService:
                 {"status": {"$in": ["completed", "images_ready"]}},
                 {"_id": 0}  # 排除MongoDB的_id字段
             ).sort("created_at", -1).limit(limit).skip(skip)
+            if self._history_list_hint:
+                cursor = cursor.hint(self._history_list_hint)
             
             tasks = await cursor.to_list(length=limit)
-            logger.info(f"获取到 {len(tasks)} 个历史任务")
+            logger.info("获取到 %d 个历史任务", len(tasks))
             return tasks
             
         except Exception as e:
-            logger.error(f"获取历史任务列表失败: {str(e)}")
+            logger.error("获取历史任务列表失败: %s", e)
             return []
     
     async def get_history_task_by_id(self, task_id: str) -> Optional[Dict[str, Any]]:
         """根据ID获取特定历史任务"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法获取历史任务")
             return None
         
@@ -148,19 +202,19 @@ class DatabaseService:
             )
             
             if task:
-                logger.info(f"获取到历史任务: task_id={task_id}")
+                logger.info("获取到历史任务: task_id=%s", task_id)
             else:
-                logger.warning(f"历史任务不存在: task_id={task_id}")
+                logger.warning("历史任务不存在: task_id=%s", task_id)
             
             return task
             
         except Exception as e:
-            logger.error(f"获取历史任务失败 (task_id: {task_id}): {str(e)}")
+            logger.error("获取历史任务失败 (task_id: %s): %s", task_id, e)
             return None
     
     async def delete_history_task(self, task_id: str) -> bool:
         """删除历史任务"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法删除历史任务")
             return False
         
@@ -168,19 +222,19 @@ class DatabaseService:
             result = await self.history_collection.delete_one({"task_id": task_id})
             
             if result.deleted_count > 0:
-                logger.info(f"历史任务已删除: task_id={task_id}")
+                logger.info("历史任务已删除: task_id=%s", task_id)
                 return True
             else:
-                logger.warning(f"要删除的历史任务不存在: task_id={task_id}")
+                logger.warning("要删除的历史任务不存在: task_id=%s", task_id)
                 return False
                 
         except Exception as e:
-            logger.error(f"删除历史任务失败 (task_id: {task_id}): {str(e)}")
+            logger.error("删除历史任务失败 (task_id: %s): %s", task_id, e)
             return False
     
     async def remove_image_from_history_tasks(self, image_id: str) -> int:
         """从所有历史任务中移除指定图片"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法移除图片引用")
             return 0
         
@@ -192,62 +246,154 @@ class DatabaseService:
             )
             
             updated_count = result.modified_count
-            logger.info(f"已从 {updated_count} 个历史任务中移除图片 {image_id}")
+            logger.info("已从 %d 个历史任务中移除图片 %s", updated_count, image_id)
             return updated_count
             
         except Exception as e:
-            logger.error(f"从历史任务中移除图片失败 (image_id: {image_id}): {str(e)}")
+            logger.error("从历史任务中移除图片失败 (image_id: %s): %s", image_id, e)
+            return 0
+    
+    async def remove_images_from_history_tasks(self, image_ids: List[str]) -> int:
+        """从所有历史任务中批量移除指定图片"""
+        if not self._is_connected:
+            logger.warning("MongoDB未连接，无法移除图片引用")
+            return 0
+        
+        if not image_ids:
+            return 0
+        
+        try:
+            # 一次update_many完成所有图片的移除，避免逐张图片扫描集合
+            result = await self.history_collection.update_many(
+                {"images.file_id": {"$in": image_ids}},
+                {"$pull": {"images": {"file_id": {"$in": image_ids}}}}
+            )
+            
+            updated_count = result.modified_count
+            logger.info("已从 %d 个历史任务中移除 %d 张图片", updated_count, len(image_ids))
+            return updated_count
+            
+        except Exception as e:
+            logger.error("从历史任务中批量移除图片失败: %s", e)
             return 0
     
     async def cleanup_old_tasks(self, days: int = 30) -> int:
         """清理超过指定天数的旧任务"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法清理旧任务")
             return 0
         
+        now = datetime.now()
+        last_cleanup_at = self._last_cleanup_at.get(days)
+        if last_cleanup_at and now - last_cleanup_at < _CLEANUP_INTERVAL:
+            # 同一保留天数距上次清理不足一个周期，截止时间几乎没有前移，跳过全量扫描
+            return 0
+        
         try:
-            from datetime import timedelta
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-            
-            result = await self.history_collection.delete_many({
-                "created_at": {"$lt": cutoff_date.isoformat()}
-            })
+            # created_at 由应用以 datetime.now().isoformat()（本地时间、不带时区）写入，
+            # 截止时间用同样的格式生成，才能按字符串正确比较
+            cutoff = (now - timedelta(days=days)).isoformat()
+            
+            # 分批删除，避免一次性删除大量文档阻塞数据库
+            deleted_count = 0
+            while True:
+                batch = await self.history_collection.find(
+                    {"created_at": {"$lt": cutoff}},
+                    {"_id": 1}
+                ).limit(_CLEANUP_BATCH_SIZE).to_list(length=_CLEANUP_BATCH_SIZE)
+                if not batch:
+                    break
+                
+                result = await self.history_collection.delete_many(
+                    {"_id": {"$in": [doc["_id"] for doc in batch]}}
+                )
+                deleted_count += result.deleted_count
+                
+                if len(batch) < _CLEANUP_BATCH_SIZE:
+                    break
             
-            deleted_count = result.deleted_count
-            logger.info(f"清理了 {deleted_count} 个超过 {days} 天的旧任务")
+            self._last_cleanup_at[days] = now
+            logger.info("清理了 %d 个超过 %d 天的旧任务", deleted_count, days)
             return deleted_count
             
         except Exception as e:
-            logger.error(f"清理旧任务失败: {str(e)}")
+            logger.error("清理旧任务失败: %s", e)
             return 0
     
+    # ==================== 文件引用检查 ====================
+    
+    async def get_files_referenced_by_other_tasks(self, task_id: str, file_ids: Iterable[str]) -> Set[str]:
+        """
+        返回file_ids中仍被其他历史任务引用的文件ID
+        
+        每次删除时直接按索引查询数据库，只读取引用了这些文件的任务，结果总是反映当前数据（包括其他进程的写入）。
+        """
+        file_ids = set(file_ids)
+        if not file_ids:
+            return set()
+        
+        if not self._is_connected:
+            logger.warning("MongoDB未连接，无法检查文件引用")
+            # 无法确认引用情况时保守处理，视为全部被引用
+            return file_ids
+        
+        try:
+            id_list = list(file_ids)
+            cursor = self.history_collection.find(
+                {
+                    "task_id": {"$ne": task_id},
+                    "$or": [
+                        {"images.file_id": {"$in": id_list}},
+                        {"original_image_id": {"$in": id_list}},
+                        {"video_id": {"$in": id_list}}
+                    ]
+                },
+                _TASK_FILE_FIELDS
+            )
+            
+            referenced = set()
+            async for task in cursor:
+                referenced |= get_task_file_ids(task) & file_ids
+                if referenced == file_ids:
+                    break
+            return referenced
+            
+        except Exception as e:
+            logger.error("检查文件引用失败 (task_id: %s): %s", task_id, e)
+            return file_ids
+    
     # ==================== 图库功能相关方法 ====================
     
     async def create_gallery_group(self, group_id: str, name: str) -> bool:
         """创建图库分组"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法创建图库分组")
             return False
         
         try:
+            now = datetime.now(timezone.utc)
             group_data = {
                 "id": group_id,
                 "name": name,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
+                "created_at": now,
+                "updated_at": now
             }
             
             await self.gallery_groups_collection.insert_one(group_data)
-            logger.info(f"图库分组创建成功: {group_id} - {name}")
+            logger.info("图库分组创建成功: %s - %s", group_id, name)
             return True
             
+        except DuplicateKeyError:
+            # 由唯一索引在服务端保证，无需事先查询是否存在
+            logger.warning("图库分组已存在: group_id=%s", group_id)
+            return False
         except Exception as e:
-            logger.error(f"创建图库分组失败 (group_id: {group_id}): {str(e)}")
+            logger.error("创建图库分组失败 (group_id: %s): %s", group_id, e)
             return False
     
     async def get_gallery_groups(self) -> List[Dict[str, Any]]:
         """获取所有图库分组"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，返回空图库分组列表")
             return []
         
@@ -279,16 +425,16 @@ class DatabaseService:
             ]
             
             groups = await self.gallery_groups_collection.aggregate(pipeline).to_list(None)
-            logger.info(f"获取到 {len(groups)} 个图库分组")
+            logger.info("获取到 %d 个图库分组", len(groups))
             return groups
             
         except Exception as e:
-            logger.error(f"获取图库分组列表失败: {str(e)}")
+            logger.error("获取图库分组列表失败: %s", e)
             return []
     
     async def get_gallery_group_by_id(self, group_id: str) -> Optional[Dict[str, Any]]:
         """根据ID获取图库分组"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法获取图库分组")
             return None
         
@@ -299,19 +445,19 @@ class DatabaseService:
             )
             
             if group:
-                logger.info(f"获取到图库分组: group_id={group_id}")
+                logger.info("获取到图库分组: group_id=%s", group_id)
             else:
-                logger.warning(f"图库分组不存在: group_id={group_id}")
+                logger.warning("图库分组不存在: group_id=%s", group_id)
             
             return group
             
         except Exception as e:
-            logger.error(f"获取图库分组失败 (group_id: {group_id}): {str(e)}")
+            logger.error("获取图库分组失败 (group_id: %s): %s", group_id, e)
             return None
     
     async def update_gallery_group(self, group_id: str, name: str) -> bool:
         """更新图库分组名称"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法更新图库分组")
             return False
         
@@ -319,52 +465,51 @@ class DatabaseService:
             result = await self.gallery_groups_collection.update_one(
                 {"id": group_id},
                 {
-                    "$set": {
-                        "name": name,
-                        "updated_at": datetime.utcnow()
-                    }
+                    "$set": {"name": name},
+                    # 由服务端写入时间戳，避免应用与数据库之间的时钟偏差
+                    "$currentDate": {"updated_at": True}
                 }
             )
             
             if result.modified_count > 0:
-                logger.info(f"图库分组更新成功: group_id={group_id}")
+                logger.info("图库分组更新成功: group_id=%s", group_id)
                 return True
             else:
-                logger.warning(f"图库分组不存在或未更新: group_id={group_id}")
+                logger.warning("图库分组不存在或未更新: group_id=%s", group_id)
                 return False
                 
         except Exception as e:
-            logger.error(f"更新图库分组失败 (group_id: {group_id}): {str(e)}")
+            logger.error("更新图库分组失败 (group_id: %s): %s", group_id, e)
             return False
     
     async def delete_gallery_group(self, group_id: str) -> bool:
         """删除图库分组及其所有图片"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法删除图库分组")
             return False
         
         try:
             # 先删除分组中的所有图片
             deleted_images = await self.gallery_images_collection.delete_many({"group_id": group_id})
-            logger.info(f"已删除分组 {group_id} 中的 {deleted_images.deleted_count} 张图片")
+            logger.info("已删除分组 %s 中的 %d 张图片", group_id, deleted_images.deleted_count)
             
             # 再删除分组本身
             result = await self.gallery_groups_collection.delete_one({"id": group_id})
             
             if result.deleted_count > 0:
-                logger.info(f"图库分组删除成功: group_id={group_id}")
+                logger.info("图库分组删除成功: group_id=%s", group_id)
                 return True
             else:
-                logger.warning(f"图库分组不存在: group_id={group_id}")
+                logger.warning("图库分组不存在: group_id=%s", group_id)
                 return False
                 
         except Exception as e:
-            logger.error(f"删除图库分组失败 (group_id: {group_id}): {str(e)}")
+            logger.error("删除图库分组失败 (group_id: %s): %s", group_id, e)
             return False
     
     async def add_image_to_gallery_group(self, image_id: str, group_id: str, name: str, metadata: Dict[str, Any]) -> bool:
         """添加图片到图库分组"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法添加图片到图库分组")
             return False
         
@@ -374,20 +519,20 @@ class DatabaseService:
                 "group_id": group_id,
                 "name": name,
                 "metadata": metadata,
-                "created_at": datetime.utcnow()
+                "created_at": datetime.now(timezone.utc)
             }
             
             await self.gallery_images_collection.insert_one(image_data)
-            logger.info(f"图片添加到图库分组成功: image_id={image_id}, group_id={group_id}")
+            logger.info("图片添加到图库分组成功: image_id=%s, group_id=%s", image_id, group_id)
             return True
             
         except Exception as e:
-            logger.error(f"添加图片到图库分组失败 (image_id: {image_id}, group_id: {group_id}): {str(e)}")
+            logger.error("添加图片到图库分组失败 (image_id: %s, group_id: %s): %s", image_id, group_id, e)
             return False
     
     async def get_images_in_gallery_group(self, group_id: str) -> List[Dict[str, Any]]:
         """获取图库分组中的所有图片"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，返回空图片列表")
             return []
         
@@ -397,16 +542,16 @@ class DatabaseService:
                 {"_id": 0}
             ).sort("created_at", -1).to_list(None)
             
-            logger.info(f"从分组 {group_id} 获取到 {len(images)} 张图片")
+            logger.info("从分组 %s 获取到 %d 张图片", group_id, len(images))
             return images
             
         except Exception as e:
-            logger.error(f"获取图库分组图片失败 (group_id: {group_id}): {str(e)}")
+            logger.error("获取图库分组图片失败 (group_id: %s): %s", group_id, e)
             return []
     
     async def delete_gallery_image(self, image_id: str) -> bool:
         """删除图库图片"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法删除图库图片")
             return False
         
@@ -414,42 +559,45 @@ class DatabaseService:
             result = await self.gallery_images_collection.delete_one({"id": image_id})
             
             if result.deleted_count > 0:
-                logger.info(f"图库图片删除成功: image_id={image_id}")
+                logger.info("图库图片删除成功: image_id=%s", image_id)
                 return True
             else:
-                logger.warning(f"图库图片不存在: image_id={image_id}")
+                logger.warning("图库图片不存在: image_id=%s", image_id)
                 return False
                 
         except Exception as e:
-            logger.error(f"删除图库图片失败 (image_id: {image_id}): {str(e)}")
+            logger.error("删除图库图片失败 (image_id: %s): %s", image_id, e)
             return False
     
     async def delete_gallery_images_batch(self, image_ids: List[str]) -> int:
         """批量删除图库图片"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法批量删除图库图片")
             return 0
         
         try:
             result = await self.gallery_images_collection.delete_many({"id": {"$in": image_ids}})
             deleted_count = result.deleted_count
-            logger.info(f"批量删除图库图片成功: {deleted_count} 张")
+            logger.info("批量删除图库图片成功: %d 张", deleted_count)
+            
+            # 同步清理历史任务中对这些图片的引用
+            await self.remove_images_from_history_tasks(image_ids)
             return deleted_count
             
         except Exception as e:
-            logger.error(f"批量删除图库图片失败: {str(e)}")
+            logger.error("批量删除图库图片失败: %s", e)
             return 0
     
     async def save_file_metadata(self, file_id: str, metadata: Dict[str, Any]) -> bool:
         """保存文件元数据"""
-        if not self.is_connected():
+        if not self._is_connected:
             logger.warning("MongoDB未连接，无法保存文件元数据")
             return False
         
         try:
             metadata_copy = metadata.copy()
             metadata_copy['file_id'] = file_id
-            metadata_copy['created_at'] = datetime.utcnow()
+            metadata_copy['created_at'] = datetime.now(timezone.utc)
             
             result = await self.files_collection.replace_one(
                 {"file_id": file_id},
@@ -457,16 +605,16 @@ class DatabaseService:
                 upsert=True
             )
             
-            logger.info(f"文件元数据已保存: file_id={file_id}")
+            logger.info("文件元数据已保存: file_id=%s", file_id)
             return True
             
         except Exception as e:
-            logger.error(f"保存文件元数据失败 (file_id: {file_id}): {str(e)}")
+            logger.error("保存文件元数据失败 (file_id: %s): %s", file_id, e)
             return False
     
     async def get_file_metadata(self, file_id: str) -> Optional[Dict[str, Any]]:
         """获取文件元数据"""
-        if not self.is_connected():
+        if not self._is_connected:
             return None
         
         try:
@@ -477,12 +625,12 @@ class DatabaseService:
             return metadata
             
         except Exception as e:
-            logger.error(f"获取文件元数据失败 (file_id: {file_id}): {str(e)}")
+            logger.error("获取文件元数据失败 (file_id: %s): %s", file_id, e)
             return None
     
     async def get_database_stats(self) -> Dict[str, Any]:
         """获取数据库统计信息"""
-        if not self.is_connected():
+        if not self._is_connected:
             return {"connected": False}
         
         try:
@@ -509,7 +657,7 @@ class DatabaseService:
             }
             
         except Exception as e:
-            logger.error(f"获取数据库统计信息失败: {str(e)}")
+            logger.error("获取数据库统计信息失败: %s", e)
             return {"connected": True, "error": str(e)}
 
 
@@ -15,8 +15,10 @@ from pathlib import Path
 from typing import Dict, Optional, List, BinaryIO
 from PIL import Image
 import io
+import mmap
 
 from utils.logger import setup_logger
+from utils.file_utils import fast_move, atomic_write_bytes
 
 class FileManager:
     """文件管理器"""
@@ -44,6 +46,9 @@ class FileManager:
         
         # 确保目录存在
         self.ensure_directories()
+        
+        # 启动时扫描一次存储目录，预热文件映射
+        self._build_file_index()
     
     def ensure_directories(self):
         """确保所有必要的目录存在"""
@@ -97,8 +102,7 @@ class FileManager:
             save_path = self.uploads_path / safe_filename
             
             # 保存文件
-            with open(save_path, 'wb') as f:
-                f.write(file_bytes)
+            atomic_write_bytes(save_path, file_bytes)
             
             # 获取文件信息
             file_size = len(file_bytes)
@@ -142,53 +146,7 @@ class FileManager:
         Returns:
             文件信息字典
         """
-        try:
-            # 生成唯一文件ID
-            file_id = str(uuid.uuid4())
-            
-            # 获取原始文件名和扩展名
-            original_filename = filename
-            ext = original_filename.rsplit('.', 1)[-1].lower() if '.' in original_filename else ''
-            
-            # 生成安全的文件名
-            safe_filename = f"{file_id}.{ext}"
-            
-            # 确定保存路径
-            save_path = self.uploads_path / safe_filename
-            
-            # 保存文件
-            with open(save_path, 'wb') as f:
-                f.write(content)
-            
-            # 获取文件信息
-            file_size = len(content)
-            
-            # 如果是图片，验证并获取额外信息
-            if file_type == 'image':
-                image_info = self._validate_and_get_image_info(save_path)
-                if not image_info:
-                    save_path.unlink()  # 删除无效文件
-                    raise Exception("无效的图片文件")
-            
-            # 记录文件映射
-            self.file_mapping[file_id] = str(save_path)
-            
-            file_info = {
-                'file_id': file_id,
-                'filename': original_filename,
-                'safe_filename': safe_filename,
-                'size': file_size,
-                'type': file_type,
-                'path': str(save_path),
-                'created_at': time.time()
-            }
-            
-            self.logger.info(f"文件保存成功: {file_id} -> {save_path}")
-            return file_info
-            
-        except Exception as e:
-            self.logger.error(f"文件保存失败: {str(e)}")
-            raise
+        return self.save_uploaded_file_from_bytes(content, filename, file_type)
     
     def save_gallery_image(self, file, group_id: str) -> Dict:
         """
@@ -219,16 +177,13 @@ class FileManager:
             # 确定保存路径
             save_path = group_path / safe_filename
             
-            # 读取文件内容并保存
-            content = file.file.read()
-            file.file.seek(0)  # 重置文件指针
-            
-            # 保存文件
+            # 以1MB分块流式写入，避免将整个文件读入内存
+            src = file.file if hasattr(file, 'file') else file
+            src.seek(0)
             with open(save_path, 'wb') as f:
-                f.write(content)
-            
-            # 获取文件信息
-            file_size = len(content)
+                shutil.copyfileobj(src, f, length=1 << 20)
+                file_size = f.tell()
+            src.seek(0)  # 重置文件指针
             
             # 验证并获取图片信息
             image_info = self._validate_and_get_image_info(save_path)
@@ -269,9 +224,20 @@ class FileManager:
             图片信息字典或None（如果无效）
         """
         try:
-            with Image.open(image_path) as img:
-                width, height = img.size
-                format = img.format
+            if hasattr(mmap, 'PROT_READ'):
+                # 内存映射刚写入的文件，直接复用页缓存，避免额外的用户态拷贝
+                fd = os.open(str(image_path), os.O_RDONLY)
+                try:
+                    with mmap.mmap(fd, 0, prot=mmap.PROT_READ) as mm:
+                        with Image.open(mm) as img:
+                            width, height = img.size
+                            format = img.format
+                finally:
+                    os.close(fd)
+            else:
+                with Image.open(image_path) as img:
+                    width, height = img.size
+                    format = img.format
                 
             return {
                 'width': width,
@@ -302,17 +268,25 @@ class FileManager:
             if not data_url.startswith('data:image/'):
                 raise Exception("无效的图片数据URL")
             
-            # 提取图片数据
+            # 提取图片数据（只解码一次）
             header, encoded = data_url.split(',', 1)
             image_bytes = base64.b64decode(encoded)
             
-            # 确定文件格式
-            if 'jpeg' in header or 'jpg' in header:
+            # 写入前在内存中验证图片，避免写盘后再读回
+            try:
+                with Image.open(io.BytesIO(image_bytes)) as img:
+                    # verify()只做完整性校验，不解码像素
+                    img.verify()
+                    width, height = img.size
+                    image_format = (img.format or '').lower()
+            except Exception as e:
+                raise Exception(f"生成的图片无效: {str(e)}")
+            
+            # 根据实际图片格式确定扩展名
+            if image_format == 'jpeg':
                 ext = 'jpg'
-            elif 'png' in header:
-                ext = 'png'
-            elif 'webp' in header:
-                ext = 'webp'
+            elif image_format in self.allowed_extensions['image']:
+                ext = image_format
             else:
                 ext = 'png'  # 默认使用PNG
             
@@ -324,16 +298,7 @@ class FileManager:
             save_path = self.generated_path / safe_filename
             
             # 保存文件
-            with open(save_path, 'wb') as f:
-                f.write(image_bytes)
-            
-            # 验证图片
-            try:
-                with Image.open(save_path) as img:
-                    width, height = img.size
-            except Exception as e:
-                save_path.unlink()  # 删除无效文件
-                raise Exception(f"生成的图片无效: {str(e)}")
+            atomic_write_bytes(save_path, image_bytes)
             
             # 记录文件映射
             self.file_mapping[file_id] = str(save_path)
@@ -342,7 +307,7 @@ class FileManager:
                 'file_id': file_id,
                 'filename': safe_filename,
                 'style': image_data.get('style', ''),
-                'size': save_path.stat().st_size,
+                'size': len(image_bytes),
                 'width': width,
                 'height': height,
                 'type': 'image',
@@ -379,7 +344,7 @@ class FileManager:
             target_path = self.videos_path / safe_filename
             
             # 移动文件
-            shutil.move(video_path, target_path)
+            fast_move(video_path, target_path)
             
             # 记录文件映射
             self.file_mapping[file_id] = str(target_path)
@@ -400,6 +365,48 @@ class FileManager:
             self.logger.error(f"视频文件保存失败: {str(e)}")
             raise
     
+    def _build_file_index(self):
+        """扫描存储目录，重建文件ID到路径的映射"""
+        # uploads/gallery 文件名为 {file_id}.{ext}，generated/videos 文件名以 _{file_id}.{ext} 结尾
+        directories = [
+            (self.uploads_path, False),
+            (self.generated_path, False),
+            (self.videos_path, False),
+            (self.gallery_path, True)
+        ]
+        
+        count = 0
+        for directory, recursive in directories:
+            pending = [str(directory)]
+            while pending:
+                try:
+                    with os.scandir(pending.pop()) as entries:
+                        for entry in entries:
+                            if entry.is_file():
+                                file_id = self._extract_file_id(entry.name)
+                                if file_id and file_id not in self.file_mapping:
+                                    self.file_mapping[file_id] = entry.path
+                                    count += 1
+                            elif recursive and entry.is_dir():
+                                pending.append(entry.path)
+                except OSError as e:
+                    self.logger.error(f"扫描目录失败: {str(e)}")
+        
+        self.logger.debug(f"文件索引扫描完成，新增 {count} 条映射")
+    
+    @staticmethod
+    def _extract_file_id(filename: str) -> Optional[str]:
+        """从文件名中提取文件ID（UUID），无法识别时返回None"""
+        stem = filename.rsplit('.', 1)[0]
+        candidate = stem[-36:]
+        if len(candidate) != 36 or candidate.count('-') != 4:
+            return None
+        try:
+            uuid.UUID(candidate)
+        except ValueError:
+            return None
+        return candidate
+    
     def get_file_path(self, file_id: str) -> Optional[str]:
         """根据文件ID获取文件路径"""
         # 首先尝试从内存映射获取
@@ -407,44 +414,37 @@ class FileManager:
         if mapped_path and os.path.exists(mapped_path):
             return mapped_path
         
-        # 如果内存映射没有，尝试搜索文件系统
-        self.logger.debug(f"在内存映射中未找到 {file_id}，尝试搜索文件系统...")
-        
-        # 搜索上传文件目录
-        for file_path in self.uploads_path.glob(f"{file_id}.*"):
-            if file_path.is_file():
-                # 更新内存映射
-                self.file_mapping[file_id] = str(file_path)
-                self.logger.info(f"在uploads目录中找到文件: {file_id} -> {file_path}")
-                return str(file_path)
-        
-        # 搜索生成文件目录
-        for file_path in self.generated_path.glob(f"*{file_id}.*"):
-            if file_path.is_file():
-                # 更新内存映射
-                self.file_mapping[file_id] = str(file_path)
-                self.logger.info(f"在generated目录中找到文件: {file_id} -> {file_path}")
-                return str(file_path)
+        # 映射未命中或已失效（如文件由其他实例写入），只在各存储目录中查找该ID对应的文件
+        self.logger.debug(f"在内存映射中未找到 {file_id}，在存储目录中查找...")
+        self.file_mapping.pop(file_id, None)
         
-        # 搜索视频文件目录
-        for file_path in self.videos_path.glob(f"*{file_id}.*"):
-            if file_path.is_file():
-                # 更新内存映射
-                self.file_mapping[file_id] = str(file_path)
-                self.logger.info(f"在videos目录中找到文件: {file_id} -> {file_path}")
-                return str(file_path)
-        
-        # 搜索图库目录（包括所有子目录）
-        for file_path in self.gallery_path.rglob(f"{file_id}.*"):
-            if file_path.is_file():
-                # 更新内存映射
-                self.file_mapping[file_id] = str(file_path)
-                self.logger.info(f"在gallery目录中找到文件: {file_id} -> {file_path}")
-                return str(file_path)
+        found_path = self._find_file_on_disk(file_id)
+        if found_path:
+            self.file_mapping[file_id] = found_path
+            self.logger.info(f"在存储目录中找到文件: {file_id} -> {found_path}")
+            return found_path
         
         self.logger.warning(f"未找到文件: {file_id}")
         return None
     
+    def _find_file_on_disk(self, file_id: str) -> Optional[str]:
+        """按文件命名规则在存储目录中查找单个文件ID，不重建整个索引"""
+        # 只接受UUID格式的ID，避免把通配符等字符带入glob模式
+        if self._extract_file_id(file_id) != file_id:
+            return None
+        
+        patterns = [
+            (self.uploads_path, f"{file_id}.*"),
+            (self.generated_path, f"*_{file_id}.*"),
+            (self.videos_path, f"*_{file_id}.*"),
+            (self.gallery_path, f"*/{file_id}.*")
+        ]
+        for directory, pattern in patterns:
+            for path in directory.glob(pattern):
+                if path.is_file():
+                    return str(path)
+        return None
+    
     def delete_file(self, file_id: str) -> bool:
         """删除文件"""
         try:
@@ -485,14 +485,16 @@ class FileManager:
         if not directory.exists():
             return
         
-        for file_path in directory.iterdir():
-            if file_path.is_file():
-                try:
-                    if file_path.stat().st_mtime < cutoff_time:
-                        file_path.unlink()
-                        self.logger.info(f"清理旧文件: {file_path}")
-                except Exception as e:
-                    self.logger.error(f"清理文件失败 {file_path}: {str(e)}")
-            elif file_path.is_dir():
-                # 递归清理子目录
-                self._cleanup_directory(file_path, cutoff_time)
\ No newline at end of file
+        # os.scandir 的目录项自带文件类型信息，stat结果也会被缓存，减少系统调用
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    try:
+                        if entry.stat(follow_symlinks=False).st_mtime < cutoff_time:
+                            os.unlink(entry.path)
+                            self.logger.info(f"清理旧文件: {entry.path}")
+                    except Exception as e:
+                        self.logger.error(f"清理文件失败 {entry.path}: {str(e)}")
+                elif entry.is_dir(follow_symlinks=False):
+                    # 递归清理子目录
+                    self._cleanup_directory(Path(entry.path), cutoff_time)
@@ -5,12 +5,15 @@
 使用OpenRouter API生成风格化图片
 """
 
-import requests
-import concurrent.futures
+import os
+import functools
+import httpx
+import asyncio
 import base64
-import json
+import re
+import orjson
 import random
-import time
+from collections import deque
 from pathlib import Path
 from typing import List, Dict, Optional, Callable
 from PIL import Image
@@ -18,15 +21,117 @@ import io
 
 from utils.logger import setup_logger
 
+# 可选依赖：安装pyvips（需要系统libvips）后使用流式缩放，否则使用PIL
+try:
+    import pyvips
+except (ImportError, OSError):
+    pyvips = None
+
+# 响应中的图片data URL
+_DATA_URL_RE = re.compile(rb'data:image/(?:png|jpeg|jpg|webp);base64,[A-Za-z0-9+/=]+')
+
+# 超过该大小的原图不缓存编码结果
+_ENCODE_CACHE_MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+
+
+def _encode_image_to_jpeg_bytes(image_path: str, optimize: bool = True) -> bytes:
+    """读取图片并编码为JPEG字节数据，optimize控制是否额外计算最优Huffman表"""
+    if pyvips is not None:
+        try:
+            return _encode_image_with_vips(image_path, optimize)
+        except pyvips.Error:
+            # libvips无法处理的格式退回PIL
+            pass
+    
+    max_size = (2048, 2048)
+    with Image.open(image_path) as img:
+        # JPEG源图按比例缩小解码（1/2、1/4、1/8），其他格式无影响
+        img.draft('RGB', max_size)
+        
+        # 转换为RGB（去除透明通道）
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        # 限制图片大小以减少API调用开销
+        if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
+            img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        
+        # 转换为JPEG格式的字节流
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=85, optimize=optimize)
+        return buffer.getvalue()
+
+
+def _encode_image_with_vips(image_path: str, optimize: bool = True) -> bytes:
+    """使用libvips流式解码并缩放图片，避免将整张大图解码到内存"""
+    img = pyvips.Image.thumbnail(image_path, 2048, height=2048, size='down', no_rotate=True)
+    
+    # 去除透明通道
+    if img.hasalpha():
+        img = img.flatten()
+    
+    return img.jpegsave_buffer(Q=85, optimize_coding=optimize, strip=True)
+
+
+def _encode_image_file(image_path: str, optimize: bool = True) -> str:
+    """读取图片并编码为JPEG格式的data URL"""
+    image_data = base64.b64encode(_encode_image_to_jpeg_bytes(image_path, optimize)).decode('ascii')
+    return f"data:image/jpeg;base64,{image_data}"
+
+
+@functools.lru_cache(maxsize=16)
+def _encode_image_cached(image_path: str, mtime_ns: int, size: int, optimize: bool = True) -> str:
+    """带缓存的图片编码，mtime_ns和size仅作为缓存键，文件变化后自动失效"""
+    return _encode_image_file(image_path, optimize)
+
+
+class _TokenBucket:
+    """
+    异步令牌桶限速器
+    
+    记录最近的请求时间戳，时间窗口内请求数未达上限时立即放行，否则等待最早的请求移出窗口。
+    """
+    
+    def __init__(self, rate: float):
+        # 每秒请求数小于1时，以1个请求为桶容量、拉长时间窗口
+        self.burst = max(1, int(rate))
+        self.period = self.burst / rate
+        self._timestamps = deque()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """获取一个请求令牌"""
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                while self._timestamps and self._timestamps[0] <= now - self.period:
+                    self._timestamps.popleft()
+                
+                if len(self._timestamps) < self.burst:
+                    self._timestamps.append(now)
+                    return
+                
+                await asyncio.sleep(self._timestamps[0] + self.period - now)
+
+
 class ImageGenerator:
     """图片生成器"""
     
     def __init__(self, config):
         self.config = config
         self.logger = setup_logger('ImageGenerator')
-        # 使用requests会话以复用连接
-        self.session = requests.Session()
-        self.session.timeout = 120  # 2分钟超时
+        
+    def _create_client(self) -> httpx.AsyncClient:
+        """创建支持HTTP/2的异步客户端，并发请求复用同一个TLS连接"""
+        return httpx.AsyncClient(
+            http2=True,
+            timeout=120.0,  # 2分钟超时
+            limits=httpx.Limits(
+                max_connections=self.config.MAX_SLIDE_COUNT,
+                max_keepalive_connections=self.config.MAX_SLIDE_COUNT
+            )
+        )
         
     def generate_stylized_images(
         self, 
@@ -35,6 +140,32 @@ class ImageGenerator:
         config: Dict,
         progress_callback: Optional[Callable] = None,
         image_callback: Optional[Callable] = None
+    ) -> List[Dict]:
+        """
+        生成风格化图片（同步入口，供线程池调用）
+        
+        Args:
+            original_image_path: 原始图片路径
+            api_key: OpenRouter API密钥
+            config: 生成配置
+            progress_callback: 进度回调函数
+            
+        Returns:
+            生成的图片数据列表
+        """
+        return asyncio.run(self.generate_stylized_images_async(
+            original_image_path, api_key, config,
+            progress_callback=progress_callback,
+            image_callback=image_callback
+        ))
+    
+    async def generate_stylized_images_async(
+        self, 
+        original_image_path: str, 
+        api_key: str, 
+        config: Dict,
+        progress_callback: Optional[Callable] = None,
+        image_callback: Optional[Callable] = None
     ) -> List[Dict]:
         """
         生成风格化图片
@@ -51,92 +182,78 @@ class ImageGenerator:
         try:
             self.logger.info(f"开始生成风格化图片，数量: {config['slide_count']}")
             
-            # 读取并编码原始图片
-            image_data_url = self._encode_image_to_data_url(original_image_path)
+            # 读取并编码原始图片（在线程池中完成，不阻塞事件循环；PIL编解码时会释放GIL）
+            image_data_url = await asyncio.get_running_loop().run_in_executor(
+                None, self._encode_image_to_data_url, original_image_path
+            )
             
             # 选择风格
             selected_styles = self._select_styles(config)
+            total = len(selected_styles)
             
-            # 使用线程池实现并发限制，但逐个处理结果
-            max_workers = min(config['concurrent_limit'], len(selected_styles))
+            # 使用信号量实现并发限制，但逐个处理结果
+            semaphore = asyncio.Semaphore(max(1, min(config['concurrent_limit'], total)))
             
-            results = []
+            # 按风格顺序预分配结果位置
+            results: List[Optional[Dict]] = [None] * total
             completed_count = 0
             
-            # 使用线程池逐个提交任务
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # 提交所有任务
-                future_to_style = {}
-                for i, style in enumerate(selected_styles):
-                    future = executor.submit(
-                        self._generate_single_image_sync,
-                        api_key, image_data_url, style, i, len(selected_styles)
-                    )
-                    future_to_style[future] = (i, style)
+            # 所有请求共享同一个限速器
+            rate_limiter = _TokenBucket(self.config.MAX_RPS)
+            
+            async with self._create_client() as client:
+                async def run_one(i: int, style: str):
+                    async with semaphore:
+                        result = await self._generate_single_image(
+                            client, rate_limiter, api_key, image_data_url, style, i, total
+                        )
+                    return i, style, result
+                
+                tasks = [run_one(i, style) for i, style in enumerate(selected_styles)]
                 
                 # 逐个处理完成的任务
-                for future in concurrent.futures.as_completed(future_to_style):
-                    i, style = future_to_style[future]
-                    try:
-                        result = future.result()
-                        if result:
-                            results.append(result)
-                            
-                            # 实时回调，通知新图片生成
-                            if image_callback:
-                                image_callback(result)
-                            
-                            completed_count += 1
-                            
-                            # 更新进度
-                            if progress_callback:
-                                progress = (completed_count / len(selected_styles)) * 100
-                                progress_callback(progress)
-                            
-                            self.logger.info(f"风格 '{style}' 生成成功 ({completed_count}/{len(selected_styles)})")
-                        else:
-                            self.logger.warning(f"风格 '{style}' 生成失败")
-                            completed_count += 1
-                            
-                            # 更新进度（包括失败的）
-                            if progress_callback:
-                                progress = (completed_count / len(selected_styles)) * 100
-                                progress_callback(progress)
-                                
-                    except Exception as e:
-                        self.logger.error(f"风格 {style} 生成失败: {str(e)}")
-                        completed_count += 1
+                for next_done in asyncio.as_completed(tasks):
+                    i, style, result = await next_done
+                    results[i] = result
+                    completed_count += 1
+                    
+                    if result:
+                        
+                        # 实时回调，通知新图片生成
+                        if image_callback:
+                            image_callback(result)
                         
-                        # 更新进度（包括失败的）
-                        if progress_callback:
-                            progress = (completed_count / len(selected_styles)) * 100
-                            progress_callback(progress)
+                        self.logger.info(f"风格 '{style}' 生成成功 ({completed_count}/{total})")
+                    else:
+                        self.logger.warning(f"风格 '{style}' 生成失败")
+                    
+                    # 更新进度（包括失败的）
+                    if progress_callback:
+                        progress = (completed_count / total) * 100
+                        progress_callback(progress)
             
-            self.logger.info(f"图片生成完成，成功: {len(results)}/{len(selected_styles)}")
+            results = [r for r in results if r]
+            self.logger.info(f"图片生成完成，成功: {len(results)}/{total}")
             return results
             
         except Exception as e:
             self.logger.error(f"图片生成过程出错: {str(e)}")
             raise
     
-    def _generate_single_image_sync(
+    async def _generate_single_image(
         self, 
+        client: httpx.AsyncClient,
+        rate_limiter: '_TokenBucket',
         api_key: str, 
         image_data_url: str, 
         style: str, 
         index: int,
         total: int
     ) -> Optional[Dict]:
-        """生成单张风格化图片（同步版本）"""
+        """生成单张风格化图片"""
         try:
-            # 添加请求间隔（避免速率限制）
-            if index > 0:
-                delay = max(self.config.REQUEST_DELAY_MS / 1000.0, 2.0)  # 至少等待2秒
-                time.sleep(delay)
-                
-            # 如果是第一个请求，也稍微等待一下
-            elif index == 0:
-                time.sleep(1.0)
+            # 共享限速器控制请求速率（避免速率限制），允许并发突发
+            await rate_limiter.acquire()
             
             self.logger.info(f"正在生成风格: {style} ({index + 1}/{total})")
             
@@ -144,7 +261,7 @@ class ImageGenerator:
             prompt = f"保持构图不变，保持人物位置不变(非常重要！！！)，把图片变成{style}风格，注意要同时修改人物的面部为对应的风格，风格改变要非常明显。"
             
             # 调用OpenRouter API
-            result_data_url = self._call_openrouter_api_sync(api_key, prompt, image_data_url)
+            result_data_url = await self._call_openrouter_api(client, api_key, prompt, image_data_url)
             
             if result_data_url:
                 return {
@@ -183,36 +300,18 @@ class ImageGenerator:
         return selected_styles[:slide_count]
     
     def _encode_image_to_data_url(self, image_path: str) -> str:
-        """将图片编码为data URL"""
+        """将图片编码为data URL（按路径、修改时间和大小缓存编码结果）"""
         try:
-            # 读取图片
-            with Image.open(image_path) as img:
-                # 转换为RGB（去除透明通道）
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    img = img.convert('RGB')
-                
-                # 限制图片大小以减少API调用开销
-                max_size = (2048, 2048)
-                if img.size[0] > max_size[0] or img.size[1] > max_size[1]:
-                    img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                
-                # 转换为JPEG格式的字节流
-                buffer = io.BytesIO()
-                img.save(buffer, format='JPEG', quality=85, optimize=True)
-                buffer.seek(0)
-                
-                # 编码为base64
-                image_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                return f"data:image/jpeg;base64,{image_data}"
+            st = os.stat(image_path)
+            if st.st_size > _ENCODE_CACHE_MAX_FILE_SIZE:
+                # 超大文件不进入缓存，避免长期占用内存
+                return _encode_image_file(image_path, self.config.JPEG_OPTIMIZE)
+            return _encode_image_cached(str(image_path), st.st_mtime_ns, st.st_size, self.config.JPEG_OPTIMIZE)
                 
         except Exception as e:
             self.logger.error(f"图片编码失败: {str(e)}")
             raise
     
-
-    
-
-    
     def _extract_image_from_response(self, response_data: Dict) -> Optional[str]:
         """从API响应中提取图片数据"""
         try:
@@ -247,12 +346,10 @@ class ImageGenerator:
                         if 'image_base64' in item:
                             return f"data:image/png;base64,{item['image_base64']}"
             
-            # 方法3: 全文搜索data URL
-            response_text = json.dumps(response_data)
-            import re
-            match = re.search(r'data:image/(?:png|jpeg|jpg|webp);base64,[A-Za-z0-9+/=]+', response_text)
+            # 方法3: 全文搜索data URL（直接在字节序列上匹配，省去解码）
+            match = _DATA_URL_RE.search(orjson.dumps(response_data))
             if match:
-                return match.group(0)
+                return match.group(0).decode('ascii')
             
             self.logger.warning("未能从API响应中提取到图片数据")
             return None
@@ -261,14 +358,14 @@ class ImageGenerator:
             self.logger.error(f"提取图片数据时出错: {str(e)}")
             return None
     
-    def _call_openrouter_api_sync(
+    async def _call_openrouter_api(
         self, 
+        client: httpx.AsyncClient,
         api_key: str, 
         prompt: str, 
-        image_data_url: str,
-        attempt: int = 0
+        image_data_url: str
     ) -> Optional[str]:
-        """调用OpenRouter API（同步版本）"""
+        """调用OpenRouter API"""
         headers = {
             'Authorization': f'Bearer {api_key}',
             'Content-Type': 'application/json'
@@ -295,50 +392,58 @@ class ImageGenerator:
             ]
         }
         
-        try:
-            response = self.session.post(
-                self.config.OPENROUTER_BASE_URL,
-                headers=headers,
-                json=payload,
-                timeout=120
-            )
-            
-            if response.status_code == 429:
-                # 处理速率限制，增加重试次数
-                max_retries = 5  # 增加重试次数
-                if attempt < max_retries:
-                    # 指数退避 + 随机抖动 + 基础等待时间
-                    base_wait = 5.0  # 基础等待时间增加到5秒
-                    backoff = min(base_wait + (2 ** attempt) * 3, 30) + random.uniform(0, 2.0)
-                    self.logger.warning(f"速率限制，等待 {backoff:.1f} 秒后重试... (第{attempt+1}次重试)")
-                    time.sleep(backoff)
-                    return self._call_openrouter_api_sync(api_key, prompt, image_data_url, attempt + 1)
+        max_retries = 5  # 速率限制最大重试次数
+        attempt = 0
+        while True:
+            try:
+                response = await client.post(
+                    self.config.OPENROUTER_BASE_URL,
+                    headers=headers,
+                    json=payload
+                )
+                
+                if response.status_code == 429:
+                    # 处理速率限制
+                    if attempt < max_retries:
+                        # 优先使用服务端返回的Retry-After，否则指数退避 + 基础等待时间
+                        backoff = self._get_retry_after(response)
+                        if backoff is None:
+                            base_wait = 5.0  # 基础等待时间5秒
+                            backoff = min(base_wait + (2 ** attempt) * 3, 30)
+                        backoff += random.uniform(0, 2.0)  # 随机抖动
+                        self.logger.warning(f"速率限制，等待 {backoff:.1f} 秒后重试... (第{attempt+1}次重试)")
+                        await asyncio.sleep(backoff)
+                        attempt += 1
+                        continue
+                    else:
+                        raise Exception(f"触发速率限制，重试次数已达上限({max_retries}次)")
+                
+                if not response.is_success:
+                    error_text = response.text
+                    raise Exception(f"OpenRouter API错误 {response.status_code}: {error_text}")
+                
+                data = orjson.loads(response.content)
+                return self._extract_image_from_response(data)
+                
+            except httpx.TimeoutException:
+                raise Exception("API请求超时")
+            except Exception as e:
+                # 只对特定类型的错误进行重试
+                if attempt < 2 and ("timeout" in str(e).lower() or "connection" in str(e).lower()):
+                    self.logger.warning(f"API调用失败，重试中: {str(e)}")
+                    await asyncio.sleep(2.0)  # 等待2秒再重试
+                    attempt += 1
                 else:
-                    raise Exception(f"触发速率限制，重试次数已达上限({max_retries}次)")
-            
-            if not response.ok:
-                error_text = response.text
-                raise Exception(f"OpenRouter API错误 {response.status_code}: {error_text}")
-            
-            data = response.json()
-            return self._extract_image_from_response(data)
-            
-        except requests.exceptions.Timeout:
-            raise Exception("API请求超时")
-        except Exception as e:
-            # 只对特定类型的错误进行重试
-            if attempt < 2 and ("timeout" in str(e).lower() or "connection" in str(e).lower()):
-                self.logger.warning(f"API调用失败，重试中: {str(e)}")
-                time.sleep(2.0)  # 等待2秒再重试
-                return self._call_openrouter_api_sync(api_key, prompt, image_data_url, attempt + 1)
-            else:
-                self.logger.error(f"API调用最终失败: {str(e)}")
-                raise
+                    self.logger.error(f"API调用最终失败: {str(e)}")
+                    raise
     
-    def __del__(self):
-        """清理资源"""
-        if hasattr(self, 'session') and self.session:
-            try:
-                self.session.close()
-            except:
-                pass
\ No newline at end of file
+    @staticmethod
+    def _get_retry_after(response: httpx.Response) -> Optional[float]:
+        """解析Retry-After响应头（秒数），无效时返回None"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return min(max(float(value), 0.0), 60.0)  # 最多等待60秒
+        except ValueError:
+            return None
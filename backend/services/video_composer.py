@@ -6,16 +6,68 @@
 """
 
 import asyncio
+import functools
+import logging
+import re
 import subprocess
 import os
-import shutil
 import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Optional, Dict, Callable
-from PIL import Image, ImageDraw, ImageFont
-import json
+from typing import List, Optional, Dict, Callable, Tuple
+from PIL import Image
 
 from utils.logger import setup_logger
+from utils.file_utils import fast_move, fast_copy
+from services.file_manager import FileManager
+
+# 已通过可用性检查的FFmpeg路径，以及各路径检测到的视频编码器（进程内缓存）
+_FFMPEG_CHECKED = set()
+_DETECTED_ENCODERS: Dict[str, str] = {}
+
+# Windows下启动FFmpeg等子进程时不创建控制台窗口（其他平台为0）
+_CREATION_FLAGS = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+
+# asyncio子进程输出读取缓冲区大小，进度行较多时减少读取次数
+_STREAM_READER_LIMIT = 1 << 20
+
+# 只保留FFmpeg stderr末尾的这么多字节用于错误信息
+_STDERR_TAIL_BYTES = 4096
+
+# 视频时长缓存的最大条目数
+_DURATION_CACHE_SIZE = 256
+
+# ffmpeg -i 输出中的时长信息
+_DURATION_RE = re.compile(rb'Duration: (\d{2}):(\d{2}):(\d{2})\.(\d{2})')
+
+# -progress 输出中用于计算进度的键
+_PROGRESS_KEY_PREFIXES = ('out_time_us=', 'out_time_ms=', 'frame=')
+
+def _convert_worker(input_path: str, output_path_str: str) -> str:
+    """
+    将特殊模式的图片转换为RGB并保存（在线程池中执行）
+    
+    只做颜色模式转换，保持原尺寸；缩放和裁剪统一由FFmpeg滤镜完成。
+    """
+    output_path = Path(output_path_str)
+    with Image.open(input_path) as img:
+        rgb = img.convert('RGB')
+    
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # 无损PNG（低压缩级别以加快编码），避免中间JPEG再次损失画质
+    rgb.save(output_path, 'PNG', compress_level=1)
+    
+    # 验证文件是否正确保存
+    try:
+        file_size = os.stat(output_path).st_size
+    except FileNotFoundError:
+        raise Exception(f"图片保存失败: {output_path}")
+    
+    if file_size == 0:
+        raise Exception(f"图片文件为空: {output_path}")
+    
+    return str(output_path)
+
 
 class VideoComposer:
     """视频合成器"""
@@ -24,25 +76,122 @@ class VideoComposer:
         self.config = config
         self.logger = setup_logger('VideoComposer')
         
-        # 检查FFmpeg是否可用
+        # 文件管理器在首次准备图片序列时创建，之后复用（创建时会扫描存储目录建立索引）
+        self._file_manager: Optional[FileManager] = None
+        
+        # FFmpeg可用性检查和编码器检测推迟到首次合成视频时进行，不拖慢服务启动
+        self._video_encoder: Optional[str] = None
+        
+        # 视频时长缓存：(路径, 修改时间, 大小) -> 时长（秒），按LRU淘汰
+        self._duration_cache: "OrderedDict[Tuple[str, int, int], float]" = OrderedDict()
+    
+    @property
+    def video_encoder(self) -> str:
+        """当前使用的视频编码器（首次访问时检测，优先硬件编码）"""
+        if self._video_encoder is None:
+            self._video_encoder = self._detect_video_encoder()
+        return self._video_encoder
+    
+    @video_encoder.setter
+    def video_encoder(self, encoder: str):
+        self._video_encoder = encoder
+    
+    def _ensure_ffmpeg_ready(self):
+        """检查FFmpeg是否可用并选择视频编码器（结果在进程内缓存）"""
         self._check_ffmpeg()
+        _ = self.video_encoder
     
     def _check_ffmpeg(self):
-        """检查FFmpeg是否可用"""
+        """检查FFmpeg是否可用（同一路径在进程内只检查一次）"""
+        if self.config.FFMPEG_PATH in _FFMPEG_CHECKED:
+            return
+        
         try:
             result = subprocess.run(
                 [self.config.FFMPEG_PATH, '-version'],
                 capture_output=True,
                 text=True,
-                timeout=10
+                timeout=10,
+                creationflags=_CREATION_FLAGS
             )
             if result.returncode != 0:
                 raise Exception("FFmpeg不可用")
+            _FFMPEG_CHECKED.add(self.config.FFMPEG_PATH)
             self.logger.info("FFmpeg检查通过")
         except Exception as e:
             self.logger.error(f"FFmpeg检查失败: {str(e)}")
             raise Exception("FFmpeg不可用，请确保已安装FFmpeg并设置正确的路径")
     
+    def _detect_video_encoder(self) -> str:
+        """
+        选择视频编码器
+        
+        配置了VIDEO_ENCODER时直接使用；为auto时检测FFmpeg支持的H.264硬件编码器，
+        按 NVENC > QSV > VideoToolbox 的顺序选择，否则使用libx264
+        """
+        configured = getattr(self.config, 'VIDEO_ENCODER', 'auto')
+        if configured and configured != 'auto':
+            self.logger.info(f"使用配置的视频编码器: {configured}")
+            return configured
+        
+        cached = _DETECTED_ENCODERS.get(self.config.FFMPEG_PATH)
+        if cached:
+            return cached
+        
+        encoder = self._probe_video_encoder()
+        _DETECTED_ENCODERS[self.config.FFMPEG_PATH] = encoder
+        return encoder
+    
+    def _probe_video_encoder(self) -> str:
+        """运行 ffmpeg -encoders 查找可用的硬件编码器"""
+        try:
+            result = subprocess.run(
+                [self.config.FFMPEG_PATH, '-hide_banner', '-encoders'],
+                capture_output=True,
+                text=True,
+                timeout=10,
+                creationflags=_CREATION_FLAGS
+            )
+            encoders = result.stdout
+            for encoder in ('h264_nvenc', 'h264_qsv', 'h264_videotoolbox'):
+                if not re.search(rf'\s{encoder}\s', encoders):
+                    continue
+                # 发行版和静态构建的FFmpeg即使没有对应硬件也会列出这些编码器，需试编码确认可用
+                if self._test_encoder(encoder):
+                    self.logger.info(f"检测到硬件编码器: {encoder}")
+                    return encoder
+                self.logger.info(f"硬件编码器 {encoder} 试编码失败，跳过")
+        except Exception as e:
+            self.logger.warning(f"检测硬件编码器失败: {str(e)}")
+        
+        return 'libx264'
+    
+    def _test_encoder(self, encoder: str) -> bool:
+        """用一小段空白画面试编码，确认编码器在当前机器上可用"""
+        try:
+            result = subprocess.run(
+                [
+                    self.config.FFMPEG_PATH, '-hide_banner', '-v', 'error',
+                    '-f', 'lavfi', '-i', 'nullsrc=s=256x256:d=0.1',
+                    '-c:v', encoder,
+                    '-f', 'null', '-'
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=10,
+                creationflags=_CREATION_FLAGS
+            )
+            return result.returncode == 0
+        except Exception as e:
+            self.logger.warning(f"试编码失败 ({encoder}): {str(e)}")
+            return False
+    
+    def _get_file_manager(self) -> FileManager:
+        """获取复用的文件管理器"""
+        if self._file_manager is None:
+            self._file_manager = FileManager(self.config.STORAGE_PATH)
+        return self._file_manager
+    
     async def compose_video(
         self,
         original_image_path: str,
@@ -68,6 +217,9 @@ class VideoComposer:
         try:
             self.logger.info("开始视频合成")
             
+            # 首次合成时检查FFmpeg并检测编码器（会启动子进程，放到线程池中执行）
+            await asyncio.get_running_loop().run_in_executor(None, self._ensure_ffmpeg_ready)
+            
             # 创建任务专用工作目录（使用项目本地目录）
             temp_base = Path(self.config.STORAGE_PATH) / 'temp'
             temp_base.mkdir(parents=True, exist_ok=True)
@@ -106,13 +258,14 @@ class VideoComposer:
                 if progress_callback:
                     progress_callback(70)
                 
-                # 添加音频（如果有）
+                # 添加音频（如果有），视频时长由图片数量和配置直接算出，无需再调用ffprobe
                 final_video = await self._add_audio_to_video(
                     video_no_audio,
                     audio_path,
                     config,
                     temp_path,
-                    progress_callback
+                    progress_callback,
+                    known_duration=self._compute_video_duration(len(image_sequence), config)
                 )
                 
                 if progress_callback:
@@ -121,7 +274,7 @@ class VideoComposer:
                 # 移动到最终位置
                 output_path = Path(self.config.STORAGE_PATH) / 'videos' / f"stylized_video_{int(time.time())}.mp4"
                 output_path.parent.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(final_video), str(output_path))
+                fast_move(final_video, output_path)
                 
                 if progress_callback:
                     progress_callback(100)
@@ -150,39 +303,36 @@ class VideoComposer:
         temp_path: Path
     ) -> List[str]:
         """准备图片序列"""
-        from services.file_manager import FileManager
+        file_manager = self._get_file_manager()
+        debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
         
-        file_manager = FileManager(self.config.STORAGE_PATH)
-        image_sequence = []
-        target_size = (config['width'], config['height'])
-        
-        self.logger.info(f"开始准备图片序列，原始图片: {original_image_path}")
-        self.logger.info(f"生成的图片ID列表: {generated_image_ids}")
-        self.logger.info(f"临时目录: {temp_path}")
+        self.logger.info("开始准备图片序列，原始图片: %s", original_image_path)
+        if debug_enabled:
+            self.logger.debug("生成的图片ID列表: %s", generated_image_ids)
+            self.logger.debug("临时目录: %s", temp_path)
         
         # 获取循环倍数，默认1倍
         image_multiplier = config.get('image_multiplier', 1)
-        self.logger.info(f"图片循环倍数: {image_multiplier}")
         
         # 首先处理原始图片（如果配置要求）
         base_images = []
         if config['include_original']:
-            self.logger.info("添加原始图片到序列")
             if os.path.exists(original_image_path):
                 base_images.append(('original', original_image_path))
-                self.logger.info(f"原始图片添加到基础序列: {original_image_path}")
             else:
                 self.logger.error(f"原始图片不存在: {original_image_path}")
         
         # 添加生成的图片到基础序列
         for i, image_id in enumerate(generated_image_ids):
             if image_id:  # 跳过None值
+                # get_file_path 只返回存在的文件路径，无需再次检查
                 image_path = file_manager.get_file_path(image_id)
-                self.logger.info(f"处理生成图片 {i+1}/{len(generated_image_ids)}: ID={image_id}, Path={image_path}")
                 
-                if image_path and os.path.exists(image_path):
+                if image_path:
                     base_images.append(('generated', image_path))
-                    self.logger.info(f"生成图片添加到基础序列: {image_path}")
+                    if debug_enabled:
+                        self.logger.debug("生成图片 %d/%d 加入基础序列: ID=%s, Path=%s",
+                                          i + 1, len(generated_image_ids), image_id, image_path)
                 else:
                     self.logger.warning(f"图片文件不存在: {image_path} (ID: {image_id})")
             else:
@@ -204,95 +354,55 @@ class VideoComposer:
         
         self.logger.info(f"基础图片序列数量: {len(base_images)}, 需要循环 {image_multiplier} 倍")
         
-        # 根据倍数循环生成最终图片序列
-        frame_number = 0
-        for cycle in range(image_multiplier):
-            self.logger.info(f"处理第 {cycle + 1}/{image_multiplier} 轮循环")
-            
-            for img_type, image_path in base_images:
-                output_path = temp_path / f"frame_{frame_number:03d}.jpg"
-                
-                try:
-                    resized_path = await self._resize_and_save_image(
+        # FFmpeg直接读取源图并在滤镜中缩放裁剪，只有FFmpeg可能处理不好的特殊模式才用PIL转换颜色模式
+        # 需要转换的图片在默认线程池中并行处理（PIL编解码时会释放GIL）
+        loop = asyncio.get_running_loop()
+        candidates = []
+        for index, (img_type, image_path) in enumerate(base_images):
+            try:
+                job = None
+                if self._needs_pil_preprocess(image_path):
+                    output_path = temp_path / f"frame_{index:03d}.png"
+                    job = loop.run_in_executor(
+                        None,
+                        _convert_worker,
                         image_path,
-                        target_size,
-                        output_path
+                        str(output_path)
                     )
-                    image_sequence.append(resized_path)
-                    self.logger.info(f"图片处理成功 (第{cycle+1}轮-{img_type}): {image_path} -> {resized_path}")
-                    frame_number += 1
-                except Exception as e:
-                    self.logger.error(f"图片处理失败 {image_path}: {str(e)}")
+                candidates.append((img_type, image_path, job))
+            except Exception as e:
+                self.logger.error(f"图片处理失败 {image_path}: {str(e)}")
+        
+        jobs = [job for _, _, job in candidates if job is not None]
+        job_results = iter(await asyncio.gather(*jobs, return_exceptions=True))
+        
+        prepared_images = []
+        for img_type, image_path, job in candidates:
+            if job is not None:
+                converted_path = next(job_results)
+                if isinstance(converted_path, Exception):
+                    self.logger.error(f"图片处理失败 {image_path}: {str(converted_path)}")
+                    continue
+                if debug_enabled:
+                    self.logger.debug("图片预处理成功 (%s): %s -> %s", img_type, image_path, converted_path)
+                image_path = converted_path
+            prepared_images.append((img_type, str(Path(image_path).absolute())))
+        
+        # 根据倍数循环生成最终图片序列
+        image_sequence = [image_path for _, image_path in prepared_images] * image_multiplier
         
         # 最终检查
         if not image_sequence:
             raise Exception("图片序列处理完成后仍然为空")
         
-        self.logger.info(f"准备了 {len(image_sequence)} 张图片用于视频合成")
-        # 输出所有图片路径
-        for i, img_path in enumerate(image_sequence):
-            self.logger.info(f"序列图片 {i+1}: {img_path}")
+        self.logger.info("准备了 %d 张图片用于视频合成", len(image_sequence))
         
         return image_sequence
     
-    async def _resize_and_save_image(
-        self,
-        input_path: str,
-        target_size: tuple,
-        output_path: Path
-    ) -> str:
-        """调整图片大小并保存"""
-        try:
-            with Image.open(input_path) as img:
-                # 转换为RGB
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    img = img.convert('RGB')
-                
-                # 计算缩放比例，保持宽高比
-                img_ratio = img.width / img.height
-                target_ratio = target_size[0] / target_size[1]
-                
-                if img_ratio > target_ratio:
-                    # 图片更宽，以高度为准
-                    new_height = target_size[1]
-                    new_width = int(new_height * img_ratio)
-                else:
-                    # 图片更高，以宽度为准
-                    new_width = target_size[0]
-                    new_height = int(new_width / img_ratio)
-                
-                # 调整大小
-                img_resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                
-                # 创建目标大小的画布，居中放置图片
-                canvas = Image.new('RGB', target_size, (0, 0, 0))
-                paste_x = (target_size[0] - new_width) // 2
-                paste_y = (target_size[1] - new_height) // 2
-                canvas.paste(img_resized, (paste_x, paste_y))
-                
-                # 保存
-                output_path.parent.mkdir(parents=True, exist_ok=True)
-                canvas.save(output_path, 'JPEG', quality=95)
-                
-                # 确保文件完全写入
-                import time
-                time.sleep(0.05)  # 等待50毫秒
-                
-                # 验证文件是否正确保存
-                if not output_path.exists():
-                    raise Exception(f"图片保存失败: {output_path}")
-                
-                file_size = output_path.stat().st_size
-                if file_size == 0:
-                    raise Exception(f"图片文件为空: {output_path}")
-                
-                self.logger.debug(f"图片保存成功: {output_path} (大小: {file_size} 字节)")
-                
-                return str(output_path)
-                
-        except Exception as e:
-            self.logger.error(f"图片处理失败 {input_path}: {str(e)}")
-            raise
+    def _needs_pil_preprocess(self, image_path: str) -> bool:
+        """判断图片是否需要PIL预处理（调色板、灰度透明等模式），只读取文件头"""
+        with Image.open(image_path) as img:
+            return img.mode in ('P', 'PA', 'LA')
     
     async def _create_video_from_images(
         self,
@@ -303,8 +413,9 @@ class VideoComposer:
     ) -> str:
         """从图片序列创建视频"""
         try:
-            # 如果只有一张图片，使用简单模式
-            if len(image_sequence) <= 1:
+            # 只有一张图片或无需转场时，使用简单模式（concat直接拼接）
+            # 转场需要xfade逐帧混合；两种模式都只编码一次，音频合成阶段视频流直接复制
+            if len(image_sequence) <= 1 or config.get('transition_seconds', 0) <= 0:
                 return await self._create_simple_video(image_sequence, config, temp_path, progress_callback)
             
             # 多张图片使用转场模式
@@ -314,6 +425,117 @@ class VideoComposer:
             self.logger.error(f"创建视频失败: {str(e)}")
             raise
     
+    def _compute_video_duration(self, image_count: int, config: Dict) -> float:
+        """根据图片数量和配置计算输出视频时长（秒），与 _create_video_from_images 的模式选择保持一致"""
+        total = image_count * config['per_slide_seconds']
+        transition_seconds = config.get('transition_seconds', 0)
+        if image_count > 1 and transition_seconds > 0:
+            # 每个转场让相邻两张图片重叠transition_seconds秒
+            total -= (image_count - 1) * transition_seconds
+        return total
+    
+    def _encoder_args(self, config: Dict, encoder: Optional[str] = None) -> List[str]:
+        """
+        视频编码参数
+        
+        幻灯片内容以静态画面为主，libx264使用可配置的较快预设和调优（默认veryfast + stillimage）；
+        关键帧间隔设为单张图片的帧数并关闭场景切换检测，避免转场处频繁插入I帧。
+        """
+        encoder = encoder or self.video_encoder
+        keyint = max(1, int(round(config['fps'] * config['per_slide_seconds'])))
+        
+        if encoder == 'h264_nvenc':
+            return ['-c:v', encoder, '-preset', 'p4', '-tune', 'll', '-rc', 'vbr', '-g', str(keyint)]
+        if encoder == 'h264_qsv':
+            return ['-c:v', encoder, '-preset', 'veryfast', '-g', str(keyint)]
+        if encoder == 'libx264':
+            args = ['-c:v', 'libx264', '-preset', self.config.X264_PRESET]
+            if self.config.X264_TUNE:
+                args.extend(['-tune', self.config.X264_TUNE])
+            args.extend(['-x264-params', f'keyint={keyint}:scenecut=0'])
+            return args
+        
+        # h264_videotoolbox及其他配置的编码器只设置通用的关键帧间隔
+        return ['-c:v', encoder, '-g', str(keyint)]
+    
+    async def _execute_encode_command(
+        self,
+        cmd: List[str],
+        config: Dict,
+        output_file: Path,
+        temp_path: Path,
+        operation_name: str,
+        progress_callback: Optional[Callable] = None,
+        expected_duration: Optional[float] = None
+    ) -> str:
+        """执行视频编码命令，非libx264编码器失败时改用libx264重试，之后不再使用该编码器"""
+        try:
+            return await self._execute_ffmpeg_command(
+                cmd, output_file, temp_path, operation_name, progress_callback, expected_duration
+            )
+        except Exception as e:
+            if self.video_encoder == 'libx264':
+                raise
+            
+            self.logger.warning(f"编码器 {self.video_encoder} 编码失败，改用libx264: {str(e)}")
+            encoder_args = self._encoder_args(config)
+            start = cmd.index('-c:v')
+            cmd = cmd[:start] + self._encoder_args(config, 'libx264') + cmd[start + len(encoder_args):]
+            self.video_encoder = 'libx264'
+            _DETECTED_ENCODERS[self.config.FFMPEG_PATH] = 'libx264'
+            return await self._execute_ffmpeg_command(
+                cmd, output_file, temp_path, operation_name, progress_callback, expected_duration
+            )
+    
+    def _build_image_inputs(self, absolute_paths: List[str], config: Dict):
+        """
+        构建图片输入参数和滤镜
+        
+        每张图片作为一路单帧输入，只解码一次；滤镜将其等比放大到覆盖目标尺寸后居中裁剪（与原先PIL预处理的
+        效果一致，画面不留黑边），再用loop滤镜把缩放后的这一帧重复到per_slide_seconds秒，最后统一帧率，
+        输出标签为 [s0]、[s1]...。缩放只在每张图片上执行一次，而不是每个输出帧执行一次
+        已经是目标尺寸的图片跳过scale/crop，省去无用的缩放计算
+        """
+        fps = config['fps']
+        width = config['width']
+        height = config['height']
+        target_size = (width, height)
+        # 每张图片在视频中占用的帧数
+        frame_count = max(1, round(config['per_slide_seconds'] * fps))
+        
+        sized_cache = {}
+        inputs = []
+        filter_parts = []
+        for i, image_path in enumerate(absolute_paths):
+            inputs.extend(['-i', image_path])
+            
+            if image_path not in sized_cache:
+                sized_cache[image_path] = self._get_image_size(image_path) == target_size
+            
+            if sized_cache[image_path]:
+                normalize = ""
+            else:
+                normalize = (
+                    f"scale={width}:{height}:force_original_aspect_ratio=increase:flags=lanczos,"
+                    f"crop={width}:{height},"
+                )
+            filter_parts.append(
+                f"[{i}:v]{normalize}setsar=1,format=yuv420p,"
+                f"loop=loop={frame_count - 1}:size=1:start=0,setpts=N/{fps}/TB,"
+                f"fps={fps},settb=AVTB[s{i}]"
+            )
+        
+        return inputs, filter_parts
+    
+    def _get_image_size(self, image_path: str) -> Optional[Tuple[int, int]]:
+        """读取图片尺寸（只解析文件头），失败时返回None"""
+        try:
+            with Image.open(image_path) as img:
+                return img.size
+        except Exception as e:
+            self.logger.warning(f"读取图片尺寸失败 {image_path}: {str(e)}")
+            return None
+    
     async def _create_simple_video(
         self,
         image_sequence: List[str],
@@ -323,65 +545,52 @@ class VideoComposer:
     ) -> str:
         """创建简单视频（无转场）"""
         try:
-            # 创建图片列表文件
-            image_list_file = temp_path / "image_list.txt"
-            per_slide_seconds = config['per_slide_seconds']
+            output_video = temp_path.absolute() / "video_no_audio.mp4"
             
             self.logger.info(f"创建简单视频，图片数量: {len(image_sequence)}")
             
             if progress_callback:
                 progress_callback(10)
             
-            # 生成FFmpeg的concat文件
-            with open(image_list_file, 'w', encoding='utf-8') as f:
-                for i, image_path in enumerate(image_sequence):
-                    # 检查图片文件是否存在
-                    if not os.path.exists(image_path):
-                        self.logger.error(f"图片文件不存在: {image_path}")
-                        raise Exception(f"图片文件不存在: {image_path}")
-                    
-                    # 规范化路径，处理Windows路径问题，使用绝对路径
-                    absolute_path = str(Path(image_path).absolute()).replace('\\', '/')
-                    
-                    f.write(f"file '{absolute_path}'\n")
-                    f.write(f"duration {per_slide_seconds}\n")
-                    self.logger.debug(f"添加图片: {absolute_path}, 持续时间: {per_slide_seconds}s")
-                
-                # 最后一张图片需要额外的file行（但不需要duration）
-                if image_sequence:
-                    last_absolute_path = str(Path(image_sequence[-1]).absolute()).replace('\\', '/')
-                    f.write(f"file '{last_absolute_path}'\n")
+            # 图片序列在 _prepare_image_sequence 中已验证存在并转换为绝对路径
+            absolute_paths = image_sequence
+            
+            # 每张图片作为一路单帧输入，缩放一次后重复到指定时长，多张图片用concat滤镜首尾相接
+            inputs, filter_parts = self._build_image_inputs(absolute_paths, config)
+            if len(absolute_paths) > 1:
+                labels = "".join(f"[s{i}]" for i in range(len(absolute_paths)))
+                filter_parts.append(f"{labels}concat=n={len(absolute_paths)}:v=1:a=0[vout]")
+                output_label = "[vout]"
+            else:
+                output_label = "[s0]"
             
             if progress_callback:
                 progress_callback(30)
             
-            # 输出视频路径
-            output_video = temp_path / "video_no_audio.mp4"
-            
-            # FFmpeg命令 - 使用concat方式
             cmd = [
                 self.config.FFMPEG_PATH,
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', str(image_list_file.absolute()),
-                '-r', str(config['fps']),
-                '-c:v', 'libx264',
+            ] + inputs + [
+                '-filter_complex', ";".join(filter_parts),
+                '-map', output_label,
+                *self._encoder_args(config),
                 '-pix_fmt', 'yuv420p',
                 '-colorspace', 'bt709',
                 '-color_primaries', 'bt709',
                 '-color_trc', 'bt709',
                 '-color_range', 'tv',
                 '-b:v', self.config.VIDEO_BITRATE,
-                '-preset', 'medium',
                 '-v', 'warning',
                 '-y',
-                str(output_video.absolute())
+                str(output_video)
             ]
             
             if progress_callback:
                 progress_callback(50)
             
-            return await self._execute_ffmpeg_command(cmd, output_video, temp_path, "简单视频合成", progress_callback)
+            expected_duration = self._compute_video_duration(len(absolute_paths), config)
+            return await self._execute_encode_command(
+                cmd, config, output_video, temp_path, "简单视频合成", progress_callback, expected_duration
+            )
             
         except Exception as e:
             self.logger.error(f"创建简单视频失败: {str(e)}")
@@ -416,127 +625,64 @@ class VideoComposer:
             if progress_callback:
                 progress_callback(5)
             
-            # 验证所有图片文件存在
-            for i, image_path in enumerate(image_sequence):
-                if not os.path.exists(image_path):
-                    self.logger.error(f"图片文件不存在: {image_path}")
-                    raise Exception(f"图片文件不存在: {image_path}")
+            # 图片序列在 _prepare_image_sequence 中已验证存在并转换为绝对路径
+            absolute_paths = image_sequence
             
             if progress_callback:
                 progress_callback(10)
             
-            # 第一步：为每张图片创建独立的视频片段
-            video_segments = []
-            total_segments = len(image_sequence)
+            # 每张图片作为一路单帧输入，在同一个滤镜图中缩放、裁剪并用xfade连接，只编码一次
+            output_video = temp_path.absolute() / "video_no_audio.mp4"
+            inputs, filter_parts = self._build_image_inputs(absolute_paths, config)
             
-            for i, image_path in enumerate(image_sequence):
-                segment_video = temp_path / f"segment_{i:03d}.mp4"
+            # 构建xfade滤镜链
+            current_label = "[s0]"
+            for i in range(len(image_sequence) - 1):
+                transition_type = transition_types[i % len(transition_types)]
+                output_label = f"[x{i}]"
                 
-                # 创建单张图片的视频片段
-                cmd = [
-                    self.config.FFMPEG_PATH,
-                    '-loop', '1',
-                    '-i', str(Path(image_path).absolute()),
-                    '-t', str(per_slide_seconds),
-                    '-r', str(fps),
-                    '-c:v', 'libx264',
-                    '-pix_fmt', 'yuv420p',
-                    '-vf', f"scale={config['width']}:{config['height']}:force_original_aspect_ratio=decrease,pad={config['width']}:{config['height']}:(ow-iw)/2:(oh-ih)/2",
-                    '-preset', 'medium',
-                    '-v', 'warning',
-                    '-y',
-                    str(segment_video.absolute())
-                ]
+                # 计算转场开始时间：每张图片的持续时间减去转场时间，逐段累加
+                offset = (i + 1) * (per_slide_seconds - transition_seconds)
                 
-                self.logger.info(f"创建视频片段 {i+1}/{len(image_sequence)}: {segment_video.name}")
-                
-                # 计算单个片段的进度：10-60%区间
-                segment_start_progress = 10 + (i * 50) // total_segments
-                segment_end_progress = 10 + ((i + 1) * 50) // total_segments
-                
-                # 进度回调传递给单个片段
-                segment_callback = None
-                if progress_callback:
-                    segment_callback = lambda p: progress_callback(segment_start_progress + (segment_end_progress - segment_start_progress) * p / 100)
-                
-                await self._execute_ffmpeg_command(cmd, segment_video, temp_path, f"视频片段{i+1}", segment_callback)
-                video_segments.append(str(segment_video.absolute()))
-                
-                # 更新片段完成进度
-                if progress_callback:
-                    progress_callback(segment_end_progress)
+                filter_parts.append(
+                    f"{current_label}[s{i+1}]xfade=transition={transition_type}:duration={transition_seconds}:offset={offset}{output_label}"
+                )
+                current_label = output_label
             
-            # 第二步：使用xfade滤镜连接所有片段
-            output_video = temp_path / "video_no_audio.mp4"
+            filter_complex = ";".join(filter_parts)
             
             if progress_callback:
-                progress_callback(65)
+                progress_callback(15)
             
-            if len(video_segments) == 1:
-                # 只有一个片段，直接复制
-                shutil.copy(video_segments[0], str(output_video))
-                self.logger.info("只有一个视频片段，直接使用")
-                if progress_callback:
-                    progress_callback(95)
-            else:
-                # 构建复杂的filter_complex命令
-                inputs = []
-                for segment in video_segments:
-                    inputs.extend(['-i', segment])
-                
-                if progress_callback:
-                    progress_callback(70)
-                
-                # 构建xfade滤镜链
-                filter_parts = []
-                current_label = "[0:v]"
-                
-                for i in range(len(video_segments) - 1):
-                    transition_type = transition_types[i % len(transition_types)]
-                    next_input = f"[{i+1}:v]"
-                    output_label = f"[v{i}]" if i < len(video_segments) - 2 else ""
-                    
-                    # 计算转场开始时间：每个片段的持续时间减去转场时间
-                    offset = per_slide_seconds - transition_seconds
-                    
-                    if i == 0:
-                        filter_part = f"{current_label}{next_input}xfade=transition={transition_type}:duration={transition_seconds}:offset={offset}{output_label}"
-                    else:
-                        filter_part = f"{current_label}{next_input}xfade=transition={transition_type}:duration={transition_seconds}:offset={offset + i * (per_slide_seconds - transition_seconds)}{output_label}"
-                    
-                    filter_parts.append(filter_part)
-                    current_label = f"[v{i}]" if output_label else ""
-                
-                filter_complex = ";".join(filter_parts)
-                
-                if progress_callback:
-                    progress_callback(75)
-                
-                cmd = [
-                    self.config.FFMPEG_PATH,
-                ] + inputs + [
-                    '-filter_complex', filter_complex,
-                    '-c:v', 'libx264',
-                    '-pix_fmt', 'yuv420p',
-                    '-colorspace', 'bt709',
-                    '-color_primaries', 'bt709',
-                    '-color_trc', 'bt709',
-                    '-color_range', 'tv',
-                    '-b:v', self.config.VIDEO_BITRATE,
-                    '-preset', 'medium',
-                    '-v', 'warning',
-                    '-y',
-                    str(output_video.absolute())
-                ]
-                
-                self.logger.info(f"执行转场合成，filter_complex: {filter_complex}")
-                
-                # 转场合成阶段的进度回调：75-95%
-                transition_callback = None
-                if progress_callback:
-                    transition_callback = lambda p: progress_callback(75 + p * 0.2)
-                
-                await self._execute_ffmpeg_command(cmd, output_video, temp_path, "转场视频合成", transition_callback)
+            cmd = [
+                self.config.FFMPEG_PATH,
+            ] + inputs + [
+                '-filter_complex', filter_complex,
+                '-map', current_label,
+                *self._encoder_args(config),
+                '-pix_fmt', 'yuv420p',
+                '-colorspace', 'bt709',
+                '-color_primaries', 'bt709',
+                '-color_trc', 'bt709',
+                '-color_range', 'tv',
+                '-b:v', self.config.VIDEO_BITRATE,
+                '-v', 'warning',
+                '-y',
+                str(output_video)
+            ]
+            
+            self.logger.info(f"执行转场合成，filter_complex: {filter_complex}")
+            
+            # 转场合成阶段的进度回调：15-95%
+            transition_callback = None
+            if progress_callback:
+                transition_callback = lambda p: progress_callback(15 + p * 0.8)
+            
+            # 输出时长：每张图片时长之和减去转场重叠部分
+            expected_duration = self._compute_video_duration(len(absolute_paths), config)
+            await self._execute_encode_command(
+                cmd, config, output_video, temp_path, "转场视频合成", transition_callback, expected_duration
+            )
             
             if progress_callback:
                 progress_callback(100)
@@ -553,10 +699,20 @@ class VideoComposer:
         output_file: Path,
         temp_path: Path,
         operation_name: str,
-        progress_callback: Optional[Callable] = None
+        progress_callback: Optional[Callable] = None,
+        expected_duration: Optional[float] = None
     ) -> str:
-        """执行FFmpeg命令的通用方法"""
+        """
+        执行FFmpeg命令的通用方法
+        
+        通过 -progress pipe:1 从stdout逐行读取编码进度；提供expected_duration（输出时长，秒）时
+        按已编码时长计算进度，否则按帧数粗略估算。
+        """
         try:
+            # 进度信息输出到stdout，关闭stderr上的统计行
+            if '-progress' not in cmd:
+                cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + cmd[1:]
+            
             self.logger.info(f"开始{operation_name}...")
             self.logger.info(f"FFmpeg命令: {' '.join(cmd)}")
             
@@ -564,135 +720,29 @@ class VideoComposer:
             if progress_callback:
                 progress_callback(0)
             
-            # 执行命令 - 使用异步方式以监控进度
-            import subprocess
-            import asyncio
-            import re
-            
-            # 启动FFmpeg进程
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=str(temp_path),
-                universal_newlines=True,
-                bufsize=1
-            )
-            
-            # 监控进度
-            progress_pattern = re.compile(r'frame=\s*(\d+)')
-            time_pattern = re.compile(r'time=(\d{2}):(\d{2}):(\d{2})\.(\d{2})')
-            
-            stdout_lines = []
-            stderr_lines = []
-            
-            # 异步读取输出
-            async def read_output():
-                loop = asyncio.get_event_loop()
-                
-                def read_stderr():
-                    lines = []
-                    try:
-                        while True:
-                            line = process.stderr.readline()
-                            if not line:
-                                break
-                            lines.append(line)
-                            
-                            # 解析进度信息
-                            if progress_callback:
-                                frame_match = progress_pattern.search(line)
-                                time_match = time_pattern.search(line)
-                                
-                                if frame_match or time_match:
-                                    # 根据不同操作类型估算进度
-                                    if "视频片段" in operation_name:
-                                        # 单个片段进度可以基于时间估算
-                                        if time_match:
-                                            hours = int(time_match.group(1))
-                                            minutes = int(time_match.group(2))
-                                            seconds = int(time_match.group(3))
-                                            total_seconds = hours * 3600 + minutes * 60 + seconds
-                                            
-                                            # 根据预期时长估算进度（简单估算）
-                                            estimated_duration = 10  # 假设最大10秒
-                                            progress = min(90, (total_seconds / estimated_duration) * 100)
-                                            progress_callback(progress)
-                                    
-                                    elif frame_match:
-                                        frame_count = int(frame_match.group(1))
-                                        # 基于帧数估算进度
-                                        if frame_count > 0:
-                                            # 简单的帧数进度估算
-                                            estimated_frames = 300  # 假设大概300帧
-                                            progress = min(90, (frame_count / estimated_frames) * 100)
-                                            progress_callback(progress)
-                    except Exception as e:
-                        self.logger.debug(f"读取stderr时出错: {e}")
-                    return lines
-                
-                def read_stdout():
-                    lines = []
-                    try:
-                        while True:
-                            line = process.stdout.readline()
-                            if not line:
-                                break
-                            lines.append(line)
-                    except Exception as e:
-                        self.logger.debug(f"读取stdout时出错: {e}")
-                    return lines
-                
-                # 在线程池中执行读取操作
-                stderr_task = loop.run_in_executor(None, read_stderr)
-                stdout_task = loop.run_in_executor(None, read_stdout)
-                
-                # 等待进程完成或超时
-                timeout = 600  # 10分钟超时
-                try:
-                    await asyncio.wait_for(
-                        asyncio.gather(stderr_task, stdout_task),
-                        timeout=timeout
-                    )
-                    stderr_lines.extend(await stderr_task)
-                    stdout_lines.extend(await stdout_task)
-                except asyncio.TimeoutError:
-                    process.kill()
-                    raise subprocess.TimeoutExpired(cmd, timeout)
-            
-            # 执行输出读取
-            await read_output()
-            
-            # 等待进程结束
-            returncode = process.wait()
+            def on_progress_line(line: str):
+                if progress_callback:
+                    self._handle_progress_line(line, progress_callback, expected_duration)
             
-            # 处理输出
-            stdout_text = ''.join(stdout_lines)
-            stderr_text = ''.join(stderr_lines)
+            # 执行命令，逐行读取进度；超时抛出subprocess.TimeoutExpired
+            returncode, stderr_text = await self._stream_ffmpeg(cmd, str(temp_path), on_progress_line, timeout=600)
             
             self.logger.info(f"{operation_name} 返回码: {returncode}")
-            if stdout_text:
-                self.logger.debug(f"{operation_name} stdout: {stdout_text}")
             if stderr_text:
                 self.logger.debug(f"{operation_name} stderr: {stderr_text}")
             
-            # 等待文件系统同步
-            import time
-            time.sleep(0.2)
-            
-            # 检查输出文件
-            if output_file.exists():
-                file_size = output_file.stat().st_size
-                if file_size > 0:
-                    self.logger.info(f"{operation_name}成功: {output_file} (大小: {file_size} 字节)")
-                    # 最终进度
-                    if progress_callback:
-                        progress_callback(100)
-                    return str(output_file)
-                else:
-                    self.logger.error(f"{operation_name}生成的文件为空: {output_file}")
-            else:
+            # 检查输出文件（FFmpeg退出前已关闭输出文件，无需等待）
+            file_size = self._get_output_size(output_file)
+            if file_size is None:
                 self.logger.error(f"{operation_name}生成的文件不存在: {output_file}")
+            elif file_size > 0:
+                self.logger.info(f"{operation_name}成功: {output_file} (大小: {file_size} 字节)")
+                # 最终进度
+                if progress_callback:
+                    progress_callback(100)
+                return str(output_file)
+            else:
+                self.logger.error(f"{operation_name}生成的文件为空: {output_file}")
             
             # 如果文件不存在或为空，检查FFmpeg错误
             if returncode != 0:
@@ -708,23 +758,210 @@ class VideoComposer:
             self.logger.error(f"{operation_name}执行异常: {str(e)}")
             raise
     
+    def _handle_progress_line(self, line: str, progress_callback: Callable, expected_duration: Optional[float]):
+        """解析一行 -progress 输出（key=value）并回调进度"""
+        # 大部分行（bitrate、speed等）与进度无关，先按前缀快速过滤
+        if not line.startswith(_PROGRESS_KEY_PREFIXES):
+            return
+        
+        key, _, value = line.strip().partition('=')
+        try:
+            if key in ('out_time_us', 'out_time_ms') and expected_duration:
+                # out_time_us/out_time_ms 的单位均为微秒
+                progress = min(99, int(value) / 1000000 / expected_duration * 100)
+                progress_callback(max(0, progress))
+            elif key == 'frame' and not expected_duration:
+                # 简单的帧数进度估算
+                estimated_frames = 300  # 假设大概300帧
+                progress = min(90, (int(value) / estimated_frames) * 100)
+                progress_callback(progress)
+        except ValueError:
+            # 编码刚开始时out_time可能为N/A
+            pass
+    
+    async def _stream_ffmpeg(
+        self,
+        cmd: List[str],
+        cwd: Optional[str],
+        on_stdout_line: Callable[[str], None],
+        timeout: float
+    ) -> Tuple[int, str]:
+        """
+        运行FFmpeg，逐行把stdout交给on_stdout_line处理，返回 (返回码, stderr末尾的文本)
+        
+        使用asyncio子进程直接在事件循环中读取输出；事件循环不支持子进程时（如Windows下
+        SelectorEventLoop）退回到Popen加读取线程的方式。
+        """
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=cwd,
+                limit=_STREAM_READER_LIMIT,
+                creationflags=_CREATION_FLAGS
+            )
+        except NotImplementedError:
+            return await self._stream_ffmpeg_threaded(cmd, cwd, on_stdout_line, timeout)
+        
+        async def drain_stdout():
+            async for raw_line in process.stdout:
+                on_stdout_line(raw_line.decode('utf-8', errors='replace'))
+        
+        try:
+            _, stderr_bytes = await asyncio.wait_for(
+                asyncio.gather(drain_stdout(), process.stderr.read()),
+                timeout=timeout
+            )
+            returncode = await process.wait()
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        
+        # 错误信息位于末尾，只解码最后一部分
+        return returncode, stderr_bytes[-_STDERR_TAIL_BYTES:].decode('utf-8', errors='replace')
+    
+    async def _stream_ffmpeg_threaded(
+        self,
+        cmd: List[str],
+        cwd: Optional[str],
+        on_stdout_line: Callable[[str], None],
+        timeout: float
+    ) -> Tuple[int, str]:
+        """_stream_ffmpeg 的线程实现，供不支持asyncio子进程的事件循环使用"""
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            universal_newlines=True,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=-1,  # 全缓冲，逐行读取由文件对象完成，避免行缓冲带来的频繁系统调用
+            creationflags=_CREATION_FLAGS
+        )
+        
+        def read_stdout():
+            for line in process.stdout:
+                on_stdout_line(line)
+        
+        loop = asyncio.get_running_loop()
+        try:
+            _, stderr_text = await asyncio.wait_for(
+                asyncio.gather(
+                    loop.run_in_executor(None, read_stdout),
+                    loop.run_in_executor(None, process.stderr.read)
+                ),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        
+        return process.wait(), stderr_text[-_STDERR_TAIL_BYTES:]
+    
+    def _get_output_size(self, output_file: Path) -> Optional[int]:
+        """
+        获取输出文件大小，文件不存在时返回None
+        
+        仅当首次读取到空文件时（如Windows上杀毒软件占用）才短暂重试，成功路径只有一次stat调用。
+        """
+        deadline = time.monotonic() + 0.2
+        while True:
+            try:
+                file_size = os.stat(output_file).st_size
+            except FileNotFoundError:
+                return None
+            if file_size > 0 or time.monotonic() >= deadline:
+                return file_size
+            time.sleep(0.02)
+    
+    async def _run_command(
+        self,
+        cmd: List[str],
+        timeout: float,
+        cwd: Optional[str] = None,
+        capture_stderr: bool = True
+    ) -> subprocess.CompletedProcess:
+        """
+        异步执行外部命令并收集输出，不阻塞事件循环
+        
+        优先使用asyncio子进程；当前事件循环不支持子进程时（如Windows下uvicorn热重载使用的
+        SelectorEventLoop）退回到线程池中执行subprocess.run。超时抛出subprocess.TimeoutExpired。
+        capture_stderr为False时stderr直接丢弃（返回结果中stderr为None），不缓冲用不到的输出。
+        """
+        stderr_target = subprocess.PIPE if capture_stderr else subprocess.DEVNULL
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=stderr_target,
+                cwd=cwd,
+                creationflags=_CREATION_FLAGS
+            )
+        except NotImplementedError:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None,
+                functools.partial(
+                    subprocess.run,
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr_target,
+                    cwd=cwd,
+                    timeout=timeout,
+                    creationflags=_CREATION_FLAGS
+                )
+            )
+        
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        
+        return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+    
+    def _replace_or_copy(self, src: str, dst: Path):
+        """
+        将src重命名为dst（同一文件系统内只更新目录项，不复制数据）
+        
+        重命名失败时（如Windows上文件被占用）尝试硬链接，都不行才复制。不使用符号链接，
+        因为结果随后会被移动到视频目录，链接会指向临时目录。
+        """
+        try:
+            os.replace(src, dst)
+            return
+        except OSError:
+            pass
+        
+        try:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            os.link(src, dst)
+        except OSError:
+            fast_copy(src, dst)
+    
     async def _add_audio_to_video(
         self,
         video_path: str,
         audio_path: Optional[str],
         config: Dict,
         temp_path: Path,
-        progress_callback: Optional[Callable] = None
+        progress_callback: Optional[Callable] = None,
+        known_duration: Optional[float] = None
     ) -> str:
-        """为视频添加音频"""
+        """为视频添加音频（已知视频时长时通过known_duration传入，省去一次ffprobe调用）"""
         output_video = temp_path / "final_video.mp4"
         
         if progress_callback:
             progress_callback(70)
         
         if not audio_path or not os.path.exists(audio_path):
-            # 没有音频，直接复制视频
-            shutil.copy2(video_path, output_video)
+            # 没有音频，直接使用原视频（中间文件之后不再使用，直接重命名，避免复制整个文件）
+            self._replace_or_copy(video_path, output_video)
             self.logger.info("没有音频文件，使用原视频")
             if progress_callback:
                 progress_callback(90)
@@ -732,17 +969,24 @@ class VideoComposer:
         
         try:
             # 获取视频时长
-            video_duration = await self._get_video_duration(video_path)
+            video_duration = known_duration or await self._get_video_duration(video_path)
+            
+            # 音频已经是AAC时直接复制，省去重新编码
+            if await self._probe_audio_codec(audio_path) == 'aac':
+                audio_args = ['-c:a', 'copy']
+            else:
+                audio_args = ['-c:a', 'aac', '-b:a', self.config.AUDIO_BITRATE]
             
             # FFmpeg命令：合并视频和音频
             cmd = [
                 self.config.FFMPEG_PATH,
+                '-progress', 'pipe:1', '-nostats',
                 '-i', video_path,
                 '-i', audio_path,
                 '-c:v', 'copy',  # 不重新编码视频
-                '-c:a', 'aac',
-                '-b:a', self.config.AUDIO_BITRATE,
+                *audio_args,
                 '-shortest',  # 以最短的流为准
+                '-v', 'warning',
                 '-y',
                 str(output_video)
             ]
@@ -751,48 +995,45 @@ class VideoComposer:
             if video_duration:
                 cmd = [
                     self.config.FFMPEG_PATH,
+                    '-progress', 'pipe:1', '-nostats',
                     '-i', video_path,
                     '-stream_loop', '-1',  # 无限循环音频
                     '-i', audio_path,
                     '-c:v', 'copy',
-                    '-c:a', 'aac',
-                    '-b:a', self.config.AUDIO_BITRATE,
+                    *audio_args,
                     '-t', str(video_duration),  # 限制输出时长
+                    '-v', 'warning',
                     '-y',
                     str(output_video)
                 ]
             
             self.logger.info(f"添加音频到视频: {' '.join(cmd)}")
             
-            # 使用同步 subprocess 以避免 Windows 上的 asyncio 限制
-            import subprocess
-            
             if progress_callback:
                 progress_callback(80)
             
+            def on_progress_line(line: str):
+                # 音频合成阶段占总进度的80%-90%
+                if progress_callback:
+                    self._handle_progress_line(line, lambda p: progress_callback(80 + p * 0.1), video_duration)
+            
             try:
-                process = subprocess.run(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    timeout=300  # 5分钟超时
+                # -v warning 下成功时stderr几乎为空，失败时只保留末尾的错误信息
+                returncode, error_msg = await self._stream_ffmpeg(
+                    cmd, None, on_progress_line, timeout=300  # 5分钟超时
                 )
                 
-                if progress_callback:
-                    progress_callback(85)
-                
-                if process.returncode != 0:
-                    error_msg = process.stderr.decode('utf-8', errors='ignore')
+                if returncode != 0:
                     self.logger.error(f"FFmpeg音频添加失败: {error_msg}")
                     # 如果添加音频失败，返回原视频
-                    shutil.copy2(video_path, output_video)
+                    self._replace_or_copy(video_path, output_video)
                     self.logger.warning("音频添加失败，返回无音频视频")
                 else:
                     self.logger.info("音频添加成功")
                     
             except subprocess.TimeoutExpired:
                 self.logger.error("音频添加超时")
-                shutil.copy2(video_path, output_video)
+                self._replace_or_copy(video_path, output_video)
                 self.logger.warning("音频添加超时，返回无音频视频")
             
             if progress_callback:
@@ -803,34 +1044,73 @@ class VideoComposer:
         except Exception as e:
             self.logger.error(f"添加音频失败: {str(e)}")
             # 出错时返回原视频
-            shutil.copy2(video_path, output_video)
+            self._replace_or_copy(video_path, output_video)
             return str(output_video)
     
+    async def _probe_audio_codec(self, audio_path: str) -> Optional[str]:
+        """使用ffprobe获取音频编码格式，失败时返回None"""
+        try:
+            cmd = [
+                self.config.FFPROBE_PATH,
+                '-v', 'error',
+                '-select_streams', 'a:0',
+                '-show_entries', 'stream=codec_name',
+                '-of', 'csv=p=0',
+                audio_path
+            ]
+            process = await self._run_command(cmd, timeout=10, capture_stderr=False)
+            if process.returncode != 0:
+                return None
+            return process.stdout.decode('utf-8', errors='ignore').strip() or None
+        except Exception as e:
+            self.logger.warning(f"获取音频编码格式失败: {str(e)}")
+            return None
+    
     async def _get_video_duration(self, video_path: str) -> Optional[float]:
-        """获取视频时长"""
+        """获取视频时长，按 (路径, 修改时间, 大小) 缓存，文件未变化时不再重复探测"""
+        try:
+            st = os.stat(video_path)
+        except OSError as e:
+            self.logger.error(f"获取视频时长失败: {str(e)}")
+            return None
+        
+        key = (video_path, st.st_mtime_ns, st.st_size)
+        duration = self._duration_cache.get(key)
+        if duration is not None:
+            self._duration_cache.move_to_end(key)
+            return duration
+        
+        duration = await self._probe_video_duration(video_path)
+        if duration is not None:
+            self._duration_cache[key] = duration
+            if len(self._duration_cache) > _DURATION_CACHE_SIZE:
+                self._duration_cache.popitem(last=False)
+        return duration
+    
+    async def _probe_video_duration(self, video_path: str) -> Optional[float]:
+        """探测视频时长（ffprobe只读取容器头信息，不解码视频帧）"""
         try:
             cmd = [
-                self.config.FFMPEG_PATH,
-                '-i', video_path,
-                '-f', 'null',
-                '-'
+                self.config.FFPROBE_PATH,
+                '-v', 'error',
+                '-show_entries', 'format=duration',
+                '-of', 'default=nw=1:nk=1',
+                video_path
             ]
             
-            # 使用同步 subprocess 以避免 Windows 上的 asyncio 限制
-            import subprocess
-            
-            process = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=60  # 1分钟超时
-            )
+            try:
+                process = await self._run_command(cmd, timeout=5, capture_stderr=False)  # 只读文件头，5秒足够
+                if process.returncode == 0:
+                    return float(process.stdout.strip())
+            except (OSError, ValueError) as e:
+                # ffprobe不可用或输出无法解析时，退回ffmpeg读取文件头
+                self.logger.warning(f"ffprobe获取视频时长失败，改用ffmpeg: {str(e)}")
             
-            stderr_text = process.stderr.decode('utf-8', errors='ignore')
+            # 不指定输出时ffmpeg只打印输入信息后退出，不会解码视频帧
+            process = await self._run_command([self.config.FFMPEG_PATH, '-i', video_path], timeout=5)
             
-            # 从FFmpeg输出中解析时长
-            import re
-            duration_match = re.search(r'Duration: (\d{2}):(\d{2}):(\d{2})\.(\d{2})', stderr_text)
+            # 从FFmpeg输出中解析时长（直接匹配字节，无需解码整个stderr）
+            duration_match = _DURATION_RE.search(process.stderr)
             if duration_match:
                 hours = int(duration_match.group(1))
                 minutes = int(duration_match.group(2))
@@ -847,4 +1127,4 @@ class VideoComposer:
             return None
         except Exception as e:
             self.logger.error(f"获取视频时长失败: {str(e)}")
-            return None
\ No newline at end of file
+            return None
@@ -4,7 +4,9 @@
 FastAPI服务测试脚本
 """
 
-import requests
+import asyncio
+import httpx
+import orjson
 import json
 import time
 from pathlib import Path
@@ -13,13 +15,13 @@ from pathlib import Path
 API_BASE = "http://localhost:5000/api"
 TEST_IMAGE_PATH = Path(__file__).parent / "test_image.jpg"
 
-def test_health_check():
+async def check_health(client):
     """测试健康检查"""
     print("🔍 测试健康检查...")
     try:
-        response = requests.get(f"{API_BASE}/health")
+        response = await client.get(f"{API_BASE}/health")
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             print(f"✅ 健康检查成功: {data['message']}")
             return True
         else:
@@ -29,13 +31,13 @@ def test_health_check():
         print(f"❌ 健康检查异常: {str(e)}")
         return False
 
-def test_config():
+async def check_config(client):
     """测试配置获取"""
     print("⚙️ 测试配置获取...")
     try:
-        response = requests.get(f"{API_BASE}/config")
+        response = await client.get(f"{API_BASE}/config")
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             print(f"✅ 配置获取成功, 支持 {len(data['supported_styles'])} 种风格")
             return True
         else:
@@ -45,7 +47,7 @@ def test_config():
         print(f"❌ 配置获取异常: {str(e)}")
         return False
 
-def test_file_upload():
+async def check_file_upload(client):
     """测试文件上传（需要测试图片）"""
     print("📤 测试文件上传...")
     
@@ -57,7 +59,7 @@ def test_file_upload():
         with open(TEST_IMAGE_PATH, 'rb') as f:
             files = {'file': f}
             data = {'type': 'image'}
-            response = requests.post(f"{API_BASE}/upload", files=files, data=data)
+            response = await client.post(f"{API_BASE}/upload", files=files, data=data)
         
         if response.status_code == 200:
             result = response.json()
@@ -71,17 +73,17 @@ def test_file_upload():
         print(f"❌ 文件上传异常: {str(e)}")
         return None
 
-def test_api_documentation():
+async def check_api_documentation(client):
     """测试API文档访问"""
     print("📚 测试API文档...")
     try:
         # 测试OpenAPI JSON
-        response = requests.get("http://localhost:5000/openapi.json")
+        response = await client.get("http://localhost:5000/openapi.json")
         if response.status_code == 200:
             print("✅ OpenAPI JSON可访问")
         
         # 测试文档页面
-        response = requests.get("http://localhost:5000/docs")
+        response = await client.get("http://localhost:5000/docs")
         if response.status_code == 200:
             print("✅ API文档页面可访问")
             return True
@@ -113,42 +115,42 @@ def create_test_image():
         print(f"❌ 创建测试图片失败: {str(e)}")
         return False
 
-def main():
+async def main():
     """主测试函数"""
     print("🚀 FastAPI服务测试开始")
     print("=" * 50)
     
+    # 所有请求复用同一个客户端（连接池），避免每次请求重新建立连接
+    async with httpx.AsyncClient(timeout=60) as client:
+        return await run_tests(client)
+
+async def run_tests(client):
+    """执行所有测试"""
     # 基础测试
     tests_passed = 0
     total_tests = 0
     
-    # 1. 健康检查
-    total_tests += 1
-    if test_health_check():
-        tests_passed += 1
-    
-    # 2. 配置获取
-    total_tests += 1
-    if test_config():
-        tests_passed += 1
-    
-    # 3. API文档
-    total_tests += 1
-    if test_api_documentation():
-        tests_passed += 1
+    # 1-3. 健康检查、配置获取、API文档互不依赖，并发执行
+    results = await asyncio.gather(
+        check_health(client),
+        check_config(client),
+        check_api_documentation(client)
+    )
+    total_tests += len(results)
+    tests_passed += sum(1 for passed in results if passed)
     
     # 4. 文件上传测试（需要测试图片）
     if not TEST_IMAGE_PATH.exists():
         if create_test_image():
             total_tests += 1
-            file_id = test_file_upload()
+            file_id = await check_file_upload(client)
             if file_id:
                 tests_passed += 1
                 
                 # 测试文件下载
                 print("📥 测试文件下载...")
                 try:
-                    response = requests.get(f"{API_BASE}/files/{file_id}")
+                    response = await client.get(f"{API_BASE}/files/{file_id}")
                     if response.status_code == 200:
                         print("✅ 文件下载成功")
                         tests_passed += 1
@@ -160,7 +162,7 @@ def main():
                     total_tests += 1
     else:
         total_tests += 1
-        file_id = test_file_upload()
+        file_id = await check_file_upload(client)
         if file_id:
             tests_passed += 1
     
@@ -177,7 +179,7 @@ def main():
 
 if __name__ == "__main__":
     try:
-        main()
+        asyncio.run(main())
     except KeyboardInterrupt:
         print("\n🛑 测试被用户中断")
     except Exception as e:
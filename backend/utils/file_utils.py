@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文件操作工具
+"""
+
+import os
+import errno
+import shutil
+import uuid
+
+
+def fast_copy(src, dst):
+    """
+    复制文件（含元数据），尽量在内核态完成
+
+    Linux 下使用 os.sendfile，Windows 下调用 CopyFileExW，两者都不经过 Python 缓冲区；
+    不支持时退回 shutil.copy2。
+    """
+    src = str(src)
+    dst = str(dst)
+
+    if os.name == 'nt':
+        try:
+            import ctypes
+            if ctypes.windll.kernel32.CopyFileExW(src, dst, None, None, None, 0):
+                return
+        except (ImportError, AttributeError, OSError):
+            pass
+        shutil.copy2(src, dst)
+        return
+
+    if not hasattr(os, 'sendfile'):
+        shutil.copy2(src, dst)
+        return
+
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            offset = 0
+            while remaining > 0:
+                sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, remaining)
+                if sent == 0:
+                    break
+                offset += sent
+                remaining -= sent
+        shutil.copystat(src, dst)
+    except OSError:
+        # sendfile 不可用（如部分文件系统不支持），退回通用实现
+        shutil.copy2(src, dst)
+
+
+def fast_move(src, dst):
+    """
+    移动文件
+
+    同一文件系统内直接原子替换（os.replace）；跨文件系统时用 fast_copy 复制后删除源文件。
+    """
+    src = str(src)
+    dst = str(dst)
+
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            # 其他错误交给 shutil.move 处理，保持原有行为
+            shutil.move(src, dst)
+            return
+
+    fast_copy(src, dst)
+    os.unlink(src)
+
+
+def _write_all(fd, data):
+    """将字节数据完整写入文件描述符，支持时先预分配空间"""
+    size = len(data)
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            # 部分文件系统不支持预分配，忽略即可
+            pass
+
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def atomic_write_bytes(path, data):
+    """
+    原子地写入文件，目标已存在时直接覆盖（各平台行为一致）
+
+    Linux 下使用 O_TMPFILE 创建匿名文件，写完并落盘后链接到同目录的临时文件名，再用 os.replace
+    替换到目标路径，中途崩溃不会留下写了一半的文件；不支持时退回“临时文件 + os.replace”。
+    """
+    path = str(path)
+    directory = os.path.dirname(path) or '.'
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+
+    if hasattr(os, 'O_TMPFILE'):
+        try:
+            fd = os.open(directory, os.O_TMPFILE | os.O_WRONLY, 0o644)
+        except OSError:
+            # 文件系统不支持 O_TMPFILE
+            fd = None
+
+        if fd is not None:
+            linked = False
+            try:
+                _write_all(fd, data)
+                os.fsync(fd)
+                os.link(f'/proc/self/fd/{fd}', tmp_path, follow_symlinks=True)
+                linked = True
+                os.replace(tmp_path, path)
+                return
+            except OSError:
+                # /proc 不可用等情况下无法链接匿名文件，改用临时文件方式
+                if linked:
+                    os.unlink(tmp_path)
+                    raise
+            finally:
+                os.close(fd)
+
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    fd = os.open(tmp_path, flags, 0o644)
+    try:
+        try:
+            _write_all(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
@@ -4,10 +4,12 @@
 日志配置工具
 """
 
+import atexit
 import logging
 import os
+import queue
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 def setup_logger(name: str = 'stylize_video', log_file: str = None, level: str = 'INFO'):
     """设置日志记录器"""
@@ -30,7 +32,7 @@ def setup_logger(name: str = 'stylize_video', log_file: str = None, level: str =
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers = [console_handler]
     
     # 文件handler
     if log_file:
@@ -42,6 +44,15 @@ def setup_logger(name: str = 'stylize_video', log_file: str = None, level: str =
         )
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     
-    return logger
\ No newline at end of file
+    # 实际的控制台/文件输出放到后台线程，记录日志时只需入队，不在调用线程上做I/O
+    log_queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # 保存引用避免被回收，退出时停止监听线程并输出剩余日志
+    logger.queue_listener = listener
+    atexit.register(listener.stop)
+    
+    return logger
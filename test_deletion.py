@@ -8,7 +8,7 @@ import asyncio
 import json
 from backend.services.database import DatabaseService
 from backend.services.file_manager import FileManager
-from backend.utils.config import Config
+from backend.utils.config import get_config
 from pathlib import Path
 
 async def test_history_task_deletion():
@@ -16,7 +16,7 @@ async def test_history_task_deletion():
     print("🧪 测试历史任务删除功能...")
     
     # 初始化配置和服务
-    config = Config()
+    config = get_config()
     db_service = DatabaseService(config.MONGODB_URL, config.MONGODB_DATABASE)
     file_manager = FileManager(config.STORAGE_PATH)
     
@@ -9,10 +9,25 @@ import sys
 import os
 sys.path.append('backend')
 
+from services.database import DatabaseService
+from utils.config import get_config
+
 async def test_file_reference_protection():
     """测试文件引用保护机制"""
     print("🧪 测试文件引用保护机制...")
-    
+
+    # 使用独立的测试数据库，避免影响正式数据
+    config = get_config()
+    test_database = f"{config.MONGODB_DATABASE}_ref_test"
+    db_service = DatabaseService(config.MONGODB_URL, test_database)
+
+    connected = await db_service.connect()
+    if not connected:
+        print("❌ 无法连接到MongoDB，请确保MongoDB服务正在运行")
+        return False
+
+    print(f"✅ MongoDB连接成功 (测试数据库: {test_database})")
+
     # 模拟历史任务数据
     mock_tasks = [
         {
@@ -25,7 +40,7 @@ async def test_file_reference_protection():
             'video_id': 'video_001'
         },
         {
-            'task_id': 'task_002', 
+            'task_id': 'task_002',
             'images': [
                 {'file_id': 'shared_image_1', 'style': '风格1'},  # 共享文件
                 {'file_id': 'unique_image_2', 'style': '风格3'}
@@ -39,107 +54,71 @@ async def test_file_reference_protection():
                 {'file_id': 'unique_image_3', 'style': '风格4'}
             ],
             'original_image_id': 'original_003',
-            'video_id': 'video_003'
+            'video_id': 'shared_video_3'
+        },
+        {
+            'task_id': 'task_004',
+            'images': [
+                {'file_id': 'shared_video_3', 'style': '风格5'}  # 与task_003的视频ID相同
+            ],
+            'original_image_id': 'original_004',
+            'video_id': 'video_004'
         }
     ]
-    
-    print(f"📋 模拟数据包含 {len(mock_tasks)} 个历史任务")
-    
-    # 模拟要删除的任务
-    task_to_delete = 'task_001'
-    
-    print(f"\n🗑️ 模拟删除任务: {task_to_delete}")
-    
-    # 计算引用情况
-    task_to_delete_data = next(t for t in mock_tasks if t['task_id'] == task_to_delete)
-    other_tasks = [t for t in mock_tasks if t['task_id'] != task_to_delete]
-    
-    # 收集其他任务引用的文件ID
-    referenced_file_ids = set()
-    for task in other_tasks:
-        # 收集图片文件ID
-        if task.get('images'):
-            for img in task['images']:
-                if img and 'file_id' in img:
-                    referenced_file_ids.add(img['file_id'])
-        
-        # 收集原始图片ID
-        if task.get('original_image_id'):
-            referenced_file_ids.add(task['original_image_id'])
-        
-        # 收集视频文件ID
-        if task.get('video_id'):
-            referenced_file_ids.add(task['video_id'])
-    
-    print(f"📊 其他任务引用的文件ID: {sorted(referenced_file_ids)}")
-    
-    # 分析待删除任务的文件
-    print(f"\n📝 分析待删除任务 {task_to_delete} 的文件:")
-    
-    # 分析图片文件
-    if task_to_delete_data.get('images'):
-        for img in task_to_delete_data['images']:
-            if img and 'file_id' in img:
-                file_id = img['file_id']
-                if file_id in referenced_file_ids:
-                    print(f"   🔗 图片 {file_id}: 被其他任务引用，将保留")
+
+    all_passed = True
+    try:
+        for task in mock_tasks:
+            await db_service.save_history_task(task['task_id'], task)
+        print(f"📋 写入 {len(mock_tasks)} 个模拟历史任务")
+
+        # 每个用例：(待删除任务, 期望仍被其他任务引用的文件)
+        cases = [
+            ('task_001', {'shared_image_1', 'shared_original_1'}),
+            ('task_002', {'shared_image_1', 'shared_original_1'}),
+            ('task_003', {'shared_video_3'}),
+            ('task_004', {'shared_video_3'}),
+        ]
+
+        for task_to_delete, expected in cases:
+            task_data = next(t for t in mock_tasks if t['task_id'] == task_to_delete)
+            file_ids = [img['file_id'] for img in task_data['images']]
+            file_ids += [task_data['original_image_id'], task_data['video_id']]
+
+            referenced = await db_service.get_files_referenced_by_other_tasks(task_to_delete, file_ids)
+
+            print(f"\n🗑️ 模拟删除任务: {task_to_delete}")
+            for file_id in file_ids:
+                if file_id in referenced:
+                    print(f"   🔗 {file_id}: 被其他任务引用，将保留")
                 else:
-                    print(f"   🗑️ 图片 {file_id}: 未被引用，将删除")
-    
-    # 分析原始图片
-    if task_to_delete_data.get('original_image_id'):
-        file_id = task_to_delete_data['original_image_id']
-        if file_id in referenced_file_ids:
-            print(f"   🔗 原始图片 {file_id}: 被其他任务引用，将保留")
-        else:
-            print(f"   🗑️ 原始图片 {file_id}: 未被引用，将删除")
-    
-    # 分析视频文件
-    if task_to_delete_data.get('video_id'):
-        file_id = task_to_delete_data['video_id']
-        if file_id in referenced_file_ids:
-            print(f"   🔗 视频 {file_id}: 被其他任务引用，将保留")
+                    print(f"   🗑️ {file_id}: 未被引用，将删除")
+
+            if referenced == expected:
+                print("   ✅ 引用检查结果正确")
+            else:
+                all_passed = False
+                print(f"   ❌ 引用检查结果错误: 期望 {sorted(expected)}, 实际 {sorted(referenced)}")
+
+        # 删除task_002后，task_001中的共享文件不再被引用
+        await db_service.delete_history_task('task_002')
+        referenced = await db_service.get_files_referenced_by_other_tasks(
+            'task_001', ['shared_image_1', 'shared_original_1']
+        )
+        print(f"\n🔍 删除 task_002 后再次检查 task_001 的共享文件: {sorted(referenced) or '无引用'}")
+        if referenced:
+            all_passed = False
+            print("   ❌ 删除后仍返回引用，检查结果未反映当前数据")
         else:
-            print(f"   🗑️ 视频 {file_id}: 未被引用，将删除")
-    
-    # 验证保护效果
-    print(f"\n✅ 引用保护机制验证:")
-    print(f"   • shared_image_1: 被 task_002 引用，应该保留")
-    print(f"   • shared_original_1: 被 task_002 引用，应该保留")
-    print(f"   • unique_image_1: 仅被 task_001 使用，应该删除")
-    print(f"   • video_001: 仅被 task_001 使用，应该删除")
-    
-    # 模拟删除后其他任务的状态
-    print(f"\n🔍 删除后验证其他任务完整性:")
-    for task in other_tasks:
-        task_id = task['task_id']
-        print(f"   📋 任务 {task_id}:")
-        
-        # 检查图片完整性
-        if task.get('images'):
-            for img in task['images']:
-                if img and 'file_id' in img:
-                    file_id = img['file_id']
-                    # 模拟文件是否还存在（被保护的文件应该存在）
-                    will_exist = file_id in referenced_file_ids or file_id not in [
-                        'shared_image_1', 'unique_image_1'  # task_001的图片
-                    ]
-                    status = "✅ 可访问" if will_exist else "❌ 文件丢失"
-                    print(f"     图片 {file_id}: {status}")
-        
-        # 检查原始图片完整性
-        if task.get('original_image_id'):
-            file_id = task['original_image_id']
-            will_exist = file_id in referenced_file_ids or file_id != 'shared_original_1'
-            status = "✅ 可访问" if will_exist else "❌ 文件丢失"
-            print(f"     原始图片 {file_id}: {status}")
-    
-    print(f"\n💡 关键改进:")
-    print(f"   • 实现了文件引用计数检查")
-    print(f"   • 只删除未被其他任务引用的文件")
-    print(f"   • 保护了共享文件的完整性")
-    print(f"   • 避免了删除操作影响其他历史任务")
-    print(f"   • 提供了孤儿文件清理API")
+            print("   ✅ 检查结果反映了最新的数据库状态")
+
+    finally:
+        await db_service.client.drop_database(test_database)
+        await db_service.disconnect()
+
+    print(f"\n{'✅ 文件引用保护测试通过' if all_passed else '❌ 文件引用保护测试失败'}")
+    return all_passed
 
 if __name__ == '__main__':
-    asyncio.run(test_file_reference_protection())
\ No newline at end of file
+    passed = asyncio.run(test_file_reference_protection())
+    sys.exit(0 if passed else 1)
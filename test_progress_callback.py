@@ -8,20 +8,21 @@ import sys
 import os
 sys.path.append('backend')
 
+import app
+
 async def test_progress_callback():
     """测试进度回调功能"""
     print("🧪 测试历史任务重新生成视频的进度回调功能...")
     
-    # 模拟 active_tasks 数据结构
-    active_tasks = {}
+    # 直接使用 app.py 中的 active_tasks 和 update_progress
+    active_tasks = app.active_tasks
+    # 未经过应用启动事件，手动指定主事件循环
+    app._event_loop = asyncio.get_running_loop()
     
-    # 模拟 update_progress 函数
     def update_progress(task_id: str, progress: float, message: str):
-        """更新任务进度"""
-        if task_id in active_tasks:
-            active_tasks[task_id]['progress'] = min(100, max(0, progress))
-            active_tasks[task_id]['message'] = message
-            print(f"[{task_id}] {progress:.1f}% - {message}")
+        """更新任务进度并打印"""
+        app.update_progress(task_id, progress, message)
+        print(f"[{task_id}] {progress:.1f}% - {message}")
     
     # 模拟任务ID
     task_id = "test_task_123"
@@ -61,6 +62,28 @@ async def test_progress_callback():
         update_progress(task_id, final_progress, '正在重新合成视频...')
         await asyncio.sleep(0.3)
     
+    # 合并窗口内的连续更新：最后一次更新应在窗口结束后补写，而不是被丢弃
+    print("\n⏱️ 模拟高频进度回调:")
+    for p in range(1, 11):
+        app.update_progress(task_id, 85 + p * 0.1, '正在重新合成视频...')
+    await asyncio.sleep(app._PROGRESS_MIN_INTERVAL * 2)
+    if abs(active_tasks[task_id]['progress'] - 86.0) < 0.01:
+        print("✅ 合并窗口结束后已补写最新进度 (86.0%)")
+    else:
+        print(f"❌ 最新进度未写入: {active_tasks[task_id]['progress']:.2f}%")
+    
+    # 图片生成的进度回调在线程池中各自的 asyncio.run 里触发，补写仍应在主事件循环中完成
+    async def worker_burst():
+        for p in range(1, 11):
+            app.update_progress(task_id, 86 + p * 0.1, '正在重新合成视频...')
+    
+    await asyncio.get_running_loop().run_in_executor(None, lambda: asyncio.run(worker_burst()))
+    await asyncio.sleep(app._PROGRESS_MIN_INTERVAL * 2)
+    if abs(active_tasks[task_id]['progress'] - 87.0) < 0.01:
+        print("✅ 线程内 asyncio.run 中的高频回调也已补写最新进度 (87.0%)")
+    else:
+        print(f"❌ 线程内的最新进度未写入: {active_tasks[task_id]['progress']:.2f}%")
+    
     # 6. 保存阶段
     update_progress(task_id, 90, '正在保存视频文件...')
     await asyncio.sleep(0.5)